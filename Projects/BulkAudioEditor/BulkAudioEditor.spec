@@ -10,7 +10,9 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Standard library modules the editor never uses; leaving them out shrinks the
+    # archive the onefile build unpacks on every start.
+    excludes=['unittest', 'doctest', 'pydoc', 'pydoc_data', 'pdb', 'xmlrpc', 'lib2to3'],
     noarchive=False,
     optimize=0,
 )
@@ -26,7 +28,8 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    # UPX-packed binaries have to be decompressed on every start, which costs more than the smaller download saves.
+    upx=False,
     upx_exclude=[],
     runtime_tmpdir=None,
     console=True,
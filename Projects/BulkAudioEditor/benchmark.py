@@ -0,0 +1,338 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from engine import AudioProcessor, plan_job
+from probe_cache import ProbeCache, default_cache_dir
+from library_scan import scan_audio_files
+
+FORMATS = {
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "192k"],
+    "flac": ["-c:a", "flac"],
+    "m4a": ["-c:a", "aac", "-b:a", "160k"],
+    "opus": ["-c:a", "libopus", "-b:a", "96k"],
+}
+DEFAULT_LENGTHS_S = (20, 120, 600)
+LEAD_SILENCE_S = 1.5
+TRAIL_SILENCE_S = 2.5
+# Opus only encodes at 48 kHz, so every fixture uses it for a like-for-like comparison.
+SAMPLE_RATE = 48000
+STAGES = ("probe", "load", "trim", "tag", "startup")
+# startup opens the editor's window, so it needs a display and is only run when asked for.
+DEFAULT_STAGES = STAGES[:4]
+PROBE_DB = "probes.sqlite3"
+BENCHMARK_METADATA = {"title": "Benchmark", "artist": "BulkAudioEditor", "album_artist": "BulkAudioEditor",
+                      "album": "Synthetic Fixtures", "track_number": "1"}
+
+
+def fixture_spec(formats, lengths):
+    """The fixture set as a dict; its hash names the fixture folder and ties results to the exact inputs."""
+    return {
+        "formats": {fmt: FORMATS[fmt] for fmt in formats},
+        "lengths_s": list(lengths),
+        "lead_silence_s": LEAD_SILENCE_S,
+        "trail_silence_s": TRAIL_SILENCE_S,
+        "sample_rate": SAMPLE_RATE,
+    }
+
+
+def fixture_id(spec):
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def generate_fixture(path, length_s, frequency, codec_args):
+    """
+    Renders a stereo sine tone of length_s seconds padded with LEAD_SILENCE_S of
+    digital silence before and TRAIL_SILENCE_S after, with lavfi's aevalsrc.
+    Bit-exact flags keep the file identical between runs of the same ffmpeg.
+    """
+    tone_end = LEAD_SILENCE_S + length_s
+    expr = f"if(between(t\\,{LEAD_SILENCE_S}\\,{tone_end})\\,0.5*sin(2*PI*{frequency}*t)\\,0)"
+    source = f"aevalsrc={expr}|{expr}:s={SAMPLE_RATE}:c=stereo:d={tone_end + TRAIL_SILENCE_S}"
+    tmp = f"{path}.tmp{os.path.splitext(path)[1]}"
+    cmd = ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", source, "-fflags", "+bitexact", "-flags:a", "+bitexact",
+           *codec_args, "-metadata", f"title=Tone {frequency} Hz", "-metadata", "artist=Fixture", tmp]
+    subprocess.run(cmd, capture_output=True, text=True, check=True)
+    os.replace(tmp, path)
+
+
+def ensure_fixtures(root, spec):
+    """
+    Creates the fixture set under root (one file per format and length) unless it
+    already exists, probes every file into the folder's probe cache and returns
+    the folder. Fixtures are kept between runs so every run measures the same
+    inputs.
+    """
+    folder = os.path.join(root, fixture_id(spec))
+    os.makedirs(folder, exist_ok=True)
+    for index, length_s in enumerate(spec["lengths_s"]):
+        for fmt, codec_args in spec["formats"].items():
+            path = os.path.join(folder, f"tone_{length_s:04d}s_{fmt}.{fmt}")
+            if not os.path.exists(path):
+                logging.info(f"Generating fixture {os.path.basename(path)}.")
+                generate_fixture(path, length_s, 220 * (index + 2), codec_args)
+    # Trim and tag runs start from a warm probe cache, as they would after the folder was loaded in the editor.
+    probe_cache = ProbeCache(os.path.join(folder, PROBE_DB))
+    for path in fixture_files(folder, spec):
+        probe_cache.probe(path)
+    return folder
+
+
+def fixture_files(folder, spec):
+    return [path for path, _ in scan_audio_files(folder, include=[f"*.{fmt}" for fmt in spec["formats"]])]
+
+
+def run_stage(stage, folder, work_dir, spec, jobs, app_command=None):
+    """
+    Runs one stage headlessly against the fixtures and returns the engine's stage
+    report for batch stages, or None. work_dir is an empty folder for outputs.
+    The startup stage instead starts app_command (the editor, from source or a
+    packaged build) and waits for it to draw its window and quit.
+    """
+    if stage == "startup":
+        env = dict(os.environ, BULKAUDIO_EXIT_AFTER_STARTUP="1")
+        result = subprocess.run(app_command, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(app_command)} exited with {result.returncode}:\n{result.stderr[-2000:]}")
+        return None
+    if stage == "load":
+        # Reopening a folder the editor has seen before: the scan plus probe cache hits.
+        probe_cache = ProbeCache(os.path.join(folder, PROBE_DB))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(probe_cache.probe, fixture_files(folder, spec)))
+        return None
+
+    files = fixture_files(folder, spec)
+    if stage == "probe":
+        # Cold: a new probe cache, so every file gets its ffprobe call and tag read.
+        probe_cache = ProbeCache(os.path.join(work_dir, PROBE_DB))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(probe_cache.probe, files))
+        return None
+
+    processor = AudioProcessor(probe_cache=ProbeCache(os.path.join(folder, PROBE_DB)))
+    if stage == "trim":
+        batch = [plan_job(path, BENCHMARK_METADATA, True, True, work_dir) for path in files]
+    else:
+        # Untrimmed MP3s only get their tags rewritten on a copy.
+        batch = [plan_job(path, BENCHMARK_METADATA, False, False, work_dir) for path in files if path.endswith(".mp3")]
+    results, report = processor.run_batch(batch, _NullQueue(), jobs)
+    failed = [result for result in results if result["status"] == "failed"]
+    if failed:
+        raise RuntimeError(f"{len(failed)} file(s) failed in the {stage} stage: {failed[0]['error']}")
+    return report
+
+
+class _NullQueue:
+    def put(self, message):
+        pass
+
+
+def _rss_mb(maxrss):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return round(maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def measure_stage(stage, folder, work_dir, spec, jobs, app_command=None):
+    """
+    Runs a stage in this process and returns its wall and CPU time and peak RSS.
+    Meant to be called in a fresh interpreter per stage (see run_worker), so peak
+    RSS belongs to the stage alone; child peak RSS is the largest ffmpeg/ffprobe.
+    """
+    started = time.monotonic()
+    stage_report = run_stage(stage, folder, work_dir, spec, jobs, app_command)
+    sample = {"wall_s": round(time.monotonic() - started, 3), "stages": (stage_report or {}).get("stages")}
+    if resource is not None:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        sample.update(
+            cpu_s=round(own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime, 3),
+            peak_rss_mb=_rss_mb(own.ru_maxrss),
+            child_peak_rss_mb=_rss_mb(children.ru_maxrss),
+        )
+    return sample
+
+
+def run_worker(stage, folder, spec, jobs, app_command):
+    """Measures one repetition of a stage in a subprocess and returns its sample dict."""
+    work_dir = tempfile.mkdtemp(prefix="bulkaudio-bench-")
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", stage, "--worker-fixtures", folder,
+               "--worker-spec", json.dumps(spec), "--worker-output", work_dir, "-j", str(jobs),
+               "--app", json.dumps(app_command)]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"The {stage} stage failed:\n{result.stderr[-2000:]}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def summarize(samples):
+    """Median wall and CPU time over the repetitions and the highest peak RSS seen."""
+    walls = [sample["wall_s"] for sample in samples]
+    median_run = sorted(samples, key=lambda sample: sample["wall_s"])[len(samples) // 2]
+    summary = {"runs": len(samples), "wall_median_s": round(statistics.median(walls), 3),
+               "wall_min_s": min(walls), "wall_max_s": max(walls), "stages": median_run["stages"]}
+    if "cpu_s" in samples[0]:
+        summary.update(
+            cpu_median_s=round(statistics.median(sample["cpu_s"] for sample in samples), 3),
+            peak_rss_mb=max(sample["peak_rss_mb"] for sample in samples),
+            child_peak_rss_mb=max(sample["child_peak_rss_mb"] for sample in samples),
+        )
+    return summary
+
+
+def _git(*args):
+    try:
+        result = subprocess.run(["git", *args], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """What a result depends on besides the code: host, interpreter and ffmpeg build."""
+    try:
+        ffmpeg = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg = None
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg,
+    }
+
+
+def previous_result(results_path, result):
+    """The latest earlier result for the same fixtures, host and job count, or None."""
+    if not os.path.exists(results_path):
+        return None
+    previous = None
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if (entry.get("fixture_id"), entry.get("jobs"), entry.get("environment", {}).get("host")) == \
+                    (result["fixture_id"], result["jobs"], result["environment"]["host"]):
+                previous = entry
+    return previous
+
+
+def format_results(result, previous=None):
+    lines = [f"{'Stage':<8}{'Median s':>10}{'Min s':>9}{'Max s':>9}{'CPU s':>9}{'RSS MB':>9}{'Child MB':>10}{'vs prev':>10}"]
+    for stage, row in result["results"].items():
+        change = ""
+        if previous and stage in previous.get("results", {}):
+            before = previous["results"][stage]["wall_median_s"]
+            if before > 0:
+                change = f"{(row['wall_median_s'] - before) / before * 100:+.1f}%"
+        lines.append(f"{stage:<8}{row['wall_median_s']:>10.2f}{row['wall_min_s']:>9.2f}{row['wall_max_s']:>9.2f}"
+                     f"{row.get('cpu_median_s', float('nan')):>9.2f}{row.get('peak_rss_mb', float('nan')):>9.1f}"
+                     f"{row.get('child_peak_rss_mb', float('nan')):>10.1f}{change:>10}")
+    if previous:
+        commit = (previous["environment"].get("commit") or "unknown")[:10]
+        lines.append(f"Compared with {commit} from {previous['timestamp']}.")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the load, probe, trim and tag paths headlessly on synthetic audio generated "
+                    "with ffmpeg, and appends the results to a JSON lines file for comparison across commits."
+    )
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                        help=f"comma-separated stages to run, among {','.join(STAGES)} (default: {','.join(DEFAULT_STAGES)})")
+    parser.add_argument("--formats", default=",".join(FORMATS), help=f"comma-separated fixture formats (default: {','.join(FORMATS)})")
+    parser.add_argument("--lengths", default=",".join(str(length) for length in DEFAULT_LENGTHS_S),
+                        help="comma-separated tone lengths in seconds, excluding the silence around them")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per stage; the median is reported (default: 3)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="parallel jobs (default: one per core)")
+    bench_dir = os.path.join(default_cache_dir(), "benchmarks")
+    parser.add_argument("--fixtures-dir", default=os.path.join(bench_dir, "fixtures"), help="where fixtures are generated and kept")
+    parser.add_argument("--results", default=os.path.join(bench_dir, "results.jsonl"), help="JSON lines file results are appended to")
+    parser.add_argument("--app", help="JSON list with the command the startup stage times, e.g. a packaged build "
+                                      "(default: main.py with this interpreter)")
+    parser.add_argument("--log-level", default="WARNING", help="logging level on stderr (default: WARNING)")
+    parser.add_argument("--worker", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-fixtures", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-spec", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+
+    if args.app:
+        app_command = json.loads(args.app)
+    else:
+        app_command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")]
+    if args.worker:
+        sample = measure_stage(args.worker, args.worker_fixtures, args.worker_output, json.loads(args.worker_spec),
+                               args.jobs, app_command)
+        print(json.dumps(sample))
+        return 0
+
+    try:
+        formats = [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()]
+        unknown = [fmt for fmt in formats if fmt not in FORMATS]
+        if unknown:
+            raise ValueError(f"unknown format(s) {', '.join(unknown)}")
+        lengths = [int(length) for length in args.lengths.split(",") if length.strip()]
+        stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+        if any(stage not in STAGES for stage in stages):
+            raise ValueError(f"stages must be among {', '.join(STAGES)}")
+    except ValueError as e:
+        parser.error(str(e))
+
+    spec = fixture_spec(formats, lengths)
+    folder = ensure_fixtures(args.fixtures_dir, spec)
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "fixture_id": fixture_id(spec),
+        "fixtures": spec,
+        "jobs": args.jobs,
+        "app": app_command if "startup" in stages else None,
+        "environment": environment(),
+        "results": {},
+    }
+    for stage in stages:
+        samples = []
+        for run in range(max(1, args.repeat)):
+            logging.info(f"Running the {stage} stage ({run + 1}/{args.repeat}).")
+            samples.append(run_worker(stage, folder, spec, args.jobs, app_command))
+        result["results"][stage] = summarize(samples)
+
+    previous = previous_result(args.results, result)
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    with open(args.results, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+    print(format_results(result, previous))
+    print(f"Results appended to {args.results}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import os
+import sys
+import csv
+import json
+import logging
+import argparse
+
+from engine import AudioProcessor, TAG_FIELDS, plan_job
+from job_journal import JobJournal
+from output_cache import OutputCache, DEFAULT_OUTPUT_CACHE_MB
+from spool import Spool, DEFAULT_SPOOL_RAM_MB
+from instrumentation import default_report_path, write_report
+
+TRUE_VALUES = ("1", "true", "yes", "y")
+
+
+class LogQueue:
+    """Stands in for the progress window's queue and sends progress messages to the log instead."""
+
+    def put(self, message):
+        if message[0] == 'progress':
+            logging.info(message[1])
+        elif message[0] == 'error':
+            logging.error(f"{message[1]}: {message[2]}")
+        elif message[0] == 'sub_task_start':
+            logging.debug(message[1])
+
+
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in TRUE_VALUES
+
+
+def read_manifest(path):
+    """
+    Reads the files to process from a JSON list of objects or a CSV file with a
+    header row. Each entry needs an "input" path and may set "output", the table's
+    metadata keys (title, artist, album_artist, album, track_number) and
+    trim_intro/trim_outro. Relative paths are resolved against the manifest.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".json"):
+            entries = json.load(f)
+        else:
+            entries = list(csv.DictReader(f))
+
+    base = os.path.dirname(os.path.abspath(path))
+    for entry in entries:
+        if not entry.get("input"):
+            raise ValueError(f"Manifest entry without an input path: {entry}")
+        entry["input"] = os.path.join(base, entry["input"])
+        if entry.get("output"):
+            entry["output"] = os.path.join(base, entry["output"])
+    return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Trim and tag audio files listed in a manifest without opening the editor. "
+                    "Prints one JSON result per file to stdout."
+    )
+    parser.add_argument("manifest", help="JSON or CSV file listing the files to process")
+    parser.add_argument("-o", "--output-folder", help="folder for outputs of entries without an explicit output path")
+    parser.add_argument("--source-root", help="folder whose subfolder layout outputs keep in the output folder "
+                                              "(default: the manifest's folder)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="parallel jobs (default: one per core)")
+    parser.add_argument("--reencode-mp3", action="store_true", help="re-encode trimmed MP3s instead of cutting them losslessly")
+    parser.add_argument("--tags-in-place", action="store_true", help="rewrite tags of untrimmed MP3s in place instead of copying them")
+    parser.add_argument("--journal", help="job journal database (default: in the user cache folder)")
+    parser.add_argument("--restart", action="store_true", help="process every file again, even outputs the journal has as completed")
+    parser.add_argument("--cache-dir", help="output cache folder (default: in the user cache folder)")
+    parser.add_argument("--cache-size-mb", type=int, default=DEFAULT_OUTPUT_CACHE_MB,
+                        help=f"output cache size limit in MB (default: {DEFAULT_OUTPUT_CACHE_MB})")
+    parser.add_argument("--no-cache", action="store_true", help="do not reuse or store cached re-encoded audio")
+    parser.add_argument("--stage", action="store_true",
+                        help="build outputs in RAM or the local temp folder and write each to the output folder once")
+    parser.add_argument("--stage-ram-mb", type=int, default=DEFAULT_SPOOL_RAM_MB,
+                        help=f"RAM to use for staging before falling back to the temp folder (default: {DEFAULT_SPOOL_RAM_MB})")
+    parser.add_argument("--report", help="write the per-stage timing report as JSON to this file "
+                                         "(default: a new file in the user cache folder)")
+    parser.add_argument("--log-level", default="INFO", help="logging level for progress on stderr (default: INFO)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+
+    # Inputs below the source root keep their subfolders in the output folder, so
+    # in/a/part01.mp3 and in/b/part01.mp3 do not both become part01.mp3.
+    source_root = os.path.abspath(args.source_root or os.path.dirname(os.path.abspath(args.manifest)))
+    try:
+        entries = read_manifest(args.manifest)
+        jobs = []
+        for entry in entries:
+            metadata = {key: str(entry.get(key) or "") for key in TAG_FIELDS}
+            jobs.append(plan_job(entry["input"], metadata, _as_bool(entry.get("trim_intro")), _as_bool(entry.get("trim_outro")),
+                                 args.output_folder, args.tags_in_place, entry.get("output") or None, source_root))
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"Could not read manifest {args.manifest}: {e}")
+        return 2
+
+    if args.output_folder:
+        os.makedirs(args.output_folder, exist_ok=True)
+
+    def print_result(result):
+        print(json.dumps(result), flush=True)
+
+    journal = JobJournal(args.journal)
+    output_cache = None if args.no_cache else OutputCache(args.cache_dir, args.cache_size_mb * 1024 * 1024)
+    spool = Spool(args.stage_ram_mb * 1024 * 1024) if args.stage else None
+    processor = AudioProcessor()
+    results, report = processor.run_batch(jobs, LogQueue(), max(1, args.jobs), not args.reencode_mp3,
+                                          on_result=print_result, journal=journal, resume=not args.restart, spool=spool,
+                                          output_cache=output_cache)
+    report_path = args.report or default_report_path()
+    try:
+        write_report(report, report_path)
+        logging.info(f"Wrote timing report to {report_path}.")
+    except OSError as e:
+        logging.warning(f"Could not write timing report to {report_path}: {e}")
+    return 1 if any(result["status"] == "failed" for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import os
+import json
+import shutil
+import logging
+import subprocess
+import importlib.util
+
+from probe_cache import default_cache_dir
+
+REQUIRED_PROGRAMS = ("ffmpeg", "ffprobe")
+
+
+def _fingerprint():
+    """
+    Where each dependency resolves to right now, with the size and mtime of the
+    programs. Finding them costs a PATH lookup and an import spec search, which
+    is much cheaper than running or importing them.
+    """
+    programs = {}
+    for name in REQUIRED_PROGRAMS:
+        path = shutil.which(name)
+        if path is None:
+            programs[name] = None
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            programs[name] = None
+            continue
+        programs[name] = [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+    spec = importlib.util.find_spec("mutagen")
+    return {"programs": programs, "mutagen": spec.origin if spec else None}
+
+
+def _check(fingerprint):
+    missing = []
+    if fingerprint["mutagen"] is None:
+        missing.append("mutagen")
+    for name in REQUIRED_PROGRAMS:
+        if fingerprint["programs"][name] is None:
+            missing.append(name)
+            continue
+        try:
+            subprocess.run([name, "-version"], capture_output=True, check=True, text=True)
+        except (subprocess.CalledProcessError, OSError):
+            missing.append(name)
+    return missing
+
+
+def find_missing_dependencies(cache_path=None):
+    """
+    Returns the names of required dependencies that are missing or broken, or an
+    empty list. The full check runs ffmpeg and ffprobe once; its result is kept
+    in cache_path and reused for as long as the dependencies still resolve to
+    the same files, so later starts only look them up.
+    """
+    if cache_path is None:
+        cache_path = os.path.join(default_cache_dir(), "dependencies.json")
+    fingerprint = _fingerprint()
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["fingerprint"] == fingerprint:
+            return cached["missing"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    missing = _check(fingerprint)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "missing": missing}, f)
+        os.replace(tmp, cache_path)
+    except OSError as e:
+        logging.warning(f"Could not cache the dependency check in {cache_path}: {e}")
+    return missing
@@ -0,0 +1,955 @@
+import os
+import re
+import math
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from probe_cache import ProbeCache, probe_sample_rate
+from scheduler import Scheduler, predict_makespan, ENCODE_SPEED, STREAM_COPY_SPEED, DECODE_SPEED, TAG_ONLY_COST_S
+
+# Length of the intro/outro windows that are searched for silence when trimming.
+TRIM_WINDOW_S = 600  # 10 minutes
+SILENCE_DETECT_FILTER = "silencedetect=noise=-40dB:duration=0.05"
+# Slack allowed when deciding whether a silence touches the start or end of the audio.
+SILENCE_EDGE_TOLERANCE_S = 0.02
+SILENCE_EVENT_RE = re.compile(r"silence_(start|end): (-?\d+(?:\.\d+)?)")
+FFMPEG_TIME_RE = re.compile(r"time=(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+# How often workers report ffmpeg progress back to the progress window.
+PROGRESS_REPORT_INTERVAL_S = 0.25
+# Untrimmed MP3s only need their tags rewritten, so they are handed to workers in batches.
+TAG_BATCH_SIZE = 64
+# Re-encodes predicted to take longer than an even share of the batch are split
+# into segments of at least this length, cut at silences and encoded in parallel.
+SEGMENT_MIN_S = 300
+# Split points are placed in the middle of a silence at least this long within
+# SPLIT_SEARCH_S of the ideal split point, so the joins are inaudible.
+SPLIT_SILENCE_MIN_S = 0.3
+SPLIT_SEARCH_S = 30
+# Each segment is encoded with this many MP3 frames of extra audio on either side,
+# which are then cut off without re-encoding so segments join sample-exactly.
+SEGMENT_OVERLAP_FRAMES = 20
+MP3_SAMPLE_RATES = (8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000)
+# Upper bound for the size of encoded output (320 kbps), used to size spool reservations.
+MAX_MP3_BYTES_PER_S = 40000
+# ioctl request for a copy-on-write clone of a whole file (Linux btrfs/XFS/bcachefs).
+FICLONE = 0x40049409
+# Table metadata keys and the easy tag names they are written to.
+TAG_FIELDS = {
+    "title": "title",
+    "artist": "artist",
+    "album_artist": "albumartist",
+    "album": "album",
+    "track_number": "tracknumber",
+}
+
+
+# One file to process: metadata uses the table's keys (see TAG_FIELDS).
+Job = namedtuple("Job", ["input_path", "output_path", "metadata", "trim_intro", "trim_outro"])
+# A file being encoded in parallel segments: bounds are the split points in
+# seconds, from the trimmed start to the trimmed end, on the MP3 frame grid.
+SegmentPlan = namedtuple("SegmentPlan", ["cache_key", "bounds", "frame_s", "temp_dir"])
+
+
+def is_tag_only(input_path, trim_intro, trim_outro):
+    """Untrimmed MP3s only need new tags, no ffmpeg work."""
+    return not trim_intro and not trim_outro and os.path.splitext(input_path)[1].lower() == '.mp3'
+
+
+def uses_stream_copy(input_path, trim_intro, trim_outro, lossless_mp3):
+    """Trimmed MP3s are cut without re-encoding in lossless mode."""
+    is_mp3 = os.path.splitext(input_path)[1].lower() == '.mp3'
+    return is_mp3 and lossless_mp3 and (trim_intro or trim_outro)
+
+
+def plan_job(input_path, metadata, trim_intro, trim_outro, output_folder=None, tags_in_place=False, output_path=None,
+             source_root=None):
+    """
+    Builds the Job for one file. Output goes to output_path if given, otherwise to
+    an .mp3 of the same name in output_folder, or back onto the input itself for
+    untrimmed MP3s when tags_in_place is set. With source_root, the folder the
+    input was scanned from, the output keeps the input's subfolder below it, so
+    bookA/part01.mp3 and bookB/part01.mp3 do not end up as the same file.
+    """
+    if output_path is None:
+        if tags_in_place and is_tag_only(input_path, trim_intro, trim_outro):
+            output_path = input_path
+        elif output_folder:
+            output_filename = f"{os.path.splitext(os.path.basename(input_path))[0]}.mp3"
+            output_path = os.path.join(output_folder, relative_folder(input_path, source_root), output_filename)
+        else:
+            raise ValueError(f"No output location for {input_path}.")
+    return Job(input_path, output_path, metadata, trim_intro, trim_outro)
+
+
+def relative_folder(path, root):
+    """The folder of path relative to root, or "" if there is no root or path is not below it."""
+    if not root:
+        return ""
+    try:
+        folder = os.path.relpath(os.path.dirname(os.path.abspath(path)), os.path.abspath(root))
+    except ValueError:  # On another drive than root.
+        return ""
+    if folder == os.curdir or folder == os.pardir or folder.startswith(os.pardir + os.sep):
+        return ""
+    return folder
+
+
+def find_output_collisions(jobs):
+    """
+    Returns (job, earlier_job) for every job that would write the same output as
+    an earlier job in the list, e.g. two inputs differing only in extension.
+    """
+    owners = {}
+    collisions = []
+    for job in jobs:
+        key = os.path.normcase(os.path.abspath(job.output_path))
+        if key in owners:
+            collisions.append((job, owners[key]))
+        else:
+            owners[key] = job
+    return collisions
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def clone_file(src, dst):
+    """
+    Copies src to dst as a reflink where the filesystem supports it, so the copy
+    shares data blocks with the original until one of them is written to, and
+    falls back to a regular copy otherwise. Returns True if a reflink was made.
+    Hard links are deliberately not used: tag writes happen in place and would
+    modify the source file through the shared inode.
+    """
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copymode(src, dst)
+            return True
+        except OSError as e:
+            logging.debug(f"Reflink of {src} not possible, copying instead: {e}")
+    shutil.copy(src, dst)
+    return False
+
+
+class BatchProgress:
+    """
+    Thread-safe totals for a processing batch. Workers add audio seconds as ffmpeg
+    reports them, and the total progress line shows the aggregate throughput as a
+    realtime multiplier (audio seconds processed per wall-clock second).
+    """
+
+    def __init__(self, q, total_files, predicted_s=None):
+        self.q = q
+        self.total_files = total_files
+        self.predicted_s = predicted_s
+        self.completed_files = 0
+        self.audio_seconds = 0.0
+        self.started = time.monotonic()
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def realtime_multiplier(self):
+        elapsed = time.monotonic() - self.started
+        return self.audio_seconds / elapsed if elapsed > 0 else 0.0
+
+    def add_audio(self, seconds):
+        with self._lock:
+            self.audio_seconds += seconds
+            now = time.monotonic()
+            if now - self._last_report < PROGRESS_REPORT_INTERVAL_S:
+                return
+            self._last_report = now
+        self.report()
+
+    def file_done(self):
+        with self._lock:
+            self.completed_files += 1
+        self.report()
+
+    def report(self):
+        text = f"Processed {self.completed_files}/{self.total_files} files - {self.realtime_multiplier():.1f}x realtime"
+        if self.predicted_s is not None:
+            text += f" - {format_seconds(time.monotonic() - self.started)} of ~{format_seconds(self.predicted_s)} predicted"
+        self.q.put(('progress', text, self.completed_files))
+
+
+class BatchRun:
+    """
+    The state of one run_batch call: the progress queue, the spool outputs are
+    staged in and the output cache re-encodes are reused from (either may be
+    None), the stage timings and, once the batch is planned, its BatchProgress.
+    It is passed down the pipeline rather than kept on the AudioProcessor, so
+    batches running at the same time never share it.
+    """
+
+    def __init__(self, q, spool=None, output_cache=None):
+        # Imported here rather than at startup, since only processing needs it.
+        from instrumentation import StageTimings
+
+        self.q = q
+        self.spool = spool
+        self.output_cache = output_cache
+        self.timings = StageTimings()
+        self.progress = None
+
+    def stage(self, name, child=False):
+        """
+        Context manager that records a pipeline stage in the run's StageTimings.
+        With child set it yields a ChildWaiter the stage's subprocess must be
+        waited for with.
+        """
+        return self.timings.process(name) if child else self.timings.thread(name)
+
+    def add_audio(self, seconds):
+        if self.progress is not None:
+            self.progress.add_audio(seconds)
+
+
+class AudioProcessor:
+    """
+    The probe/trim/tag pipeline without any GUI. Progress is reported as tuples put
+    on a queue-like object (anything with a put method), using the same messages
+    the editor's progress window understands. One processor can run several
+    batches at once; everything specific to a batch lives in its BatchRun.
+    """
+
+    def __init__(self, probe_cache=None):
+        self.probe_cache = probe_cache if probe_cache is not None else ProbeCache()
+
+    def get_audio_duration(self, filepath, run=None):
+        logging.debug(f"Getting duration for {filepath}")
+        try:
+            duration = self.probe_cache.probe(filepath, run.timings if run is not None else None).duration
+            logging.debug(f"Duration for {filepath} is {duration}s.")
+            return duration
+        except (subprocess.CalledProcessError, OSError, ValueError, KeyError) as e:
+            logging.error(f"Could not get duration for {filepath}: {e}")
+            return 0
+
+    def run_command(self, cmd, run, stage):
+        """Runs a short subprocess to completion as a timed stage and raises CalledProcessError with its stderr on failure."""
+        logging.debug(f"Running ffmpeg command: {' '.join(cmd)}")
+        with run.stage(stage, child=True) as child:
+            proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+            stderr = proc.stderr.read()
+            proc.stderr.close()
+            if child.wait(proc) != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+
+    def estimate_cost(self, job, run, lossless_mp3=True):
+        """Predicted single-core seconds for a job, from its probed duration and the throughputs in scheduler."""
+        if is_tag_only(job.input_path, job.trim_intro, job.trim_outro):
+            return TAG_ONLY_COST_S
+        duration = self.get_audio_duration(job.input_path, run)
+        cost = 0.0
+        for trim in (job.trim_intro, job.trim_outro):
+            if trim:
+                cost += min(TRIM_WINDOW_S, duration) / DECODE_SPEED
+        if uses_stream_copy(job.input_path, job.trim_intro, job.trim_outro, lossless_mp3):
+            return cost + duration / STREAM_COPY_SPEED
+        return cost + duration / ENCODE_SPEED
+
+    def run_batch(self, jobs, q, max_workers=None, lossless_mp3=True, on_result=None, journal=None, resume=True, spool=None,
+                  output_cache=None):
+        """
+        Processes jobs on a pool of max_workers threads (default: one per core) and
+        returns (results, report): one result dict per job with input, output,
+        status ("ok", "skipped" or "failed"), error and elapsed_s, and the stage
+        timing summary (see StageTimings.summary). on_result, if given, is called
+        with each result as soon as its file finishes. Failures never stop the
+        batch. A job whose output an earlier job in the list already writes fails
+        without running. With a JobJournal every outcome is recorded, and unless
+        resume is off, outputs it still has as done are skipped, so an interrupted
+        batch can simply be re-run. Missing output folders are created. With a
+        spool (see spool.Spool) outputs are built in it and written out once. With
+        an output cache (see output_cache.OutputCache) re-encoded audio is reused
+        from and stored in it; stream copies and tag-only jobs bypass it.
+
+        Jobs run longest-first by estimated cost, and re-encodes that would take
+        longer than an even share of the whole batch are split into segments
+        encoded in parallel (see prepare_segments), so one long file does not run
+        alone at the end. The predicted and actual batch durations are logged.
+        """
+        logging.info("Processing batch started.")
+        total_files = len(jobs)
+        max_workers = max_workers or os.cpu_count() or 1
+        logging.info(f"Found {total_files} file(s) to process using up to {max_workers} parallel job(s).")
+        # Created before the cost estimates so the probes they need are timed too.
+        run = BatchRun(q, spool, output_cache)
+
+        # A second job writing the same output would race the first one for the file and
+        # overwrite its journal entry, so it fails before anything runs.
+        collided = []
+        collisions = find_output_collisions(jobs)
+        if collisions:
+            collided_ids = {id(job) for job, _ in collisions}
+            jobs = [job for job in jobs if id(job) not in collided_ids]
+            for job, earlier in collisions:
+                error = ValueError(f"{job.output_path} is already the output of {earlier.input_path}.")
+                collided.append(self.job_result(job, time.monotonic(), error, lossless_mp3))
+
+        skipped = []
+        if journal is not None:
+            if resume:
+                skipped = [job for job in jobs if journal.is_done(job, lossless_mp3)]
+            if skipped:
+                skipped_ids = {id(job) for job in skipped}
+                jobs = [job for job in jobs if id(job) not in skipped_ids]
+                logging.info(f"Skipping {len(skipped)} file(s) already completed in an earlier run.")
+            journal.mark_pending(jobs, lossless_mp3)
+
+        for folder in {os.path.dirname(os.path.abspath(job.output_path)) for job in jobs}:
+            try:
+                os.makedirs(folder, exist_ok=True)
+            except OSError as e:
+                logging.warning(f"Could not create output folder {folder}: {e}")
+
+        tag_jobs = [job for job in jobs if is_tag_only(job.input_path, job.trim_intro, job.trim_outro)]
+        other_jobs = [job for job in jobs if not is_tag_only(job.input_path, job.trim_intro, job.trim_outro)]
+
+        # Durations come from the probe cache, so this is quick for files already loaded in the table.
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            costs = list(executor.map(lambda job: self.estimate_cost(job, run, lossless_mp3), other_jobs))
+        tag_batches = [tag_jobs[i:i + TAG_BATCH_SIZE] for i in range(0, len(tag_jobs), TAG_BATCH_SIZE)]
+        # Workers beyond the number of cores do not make encoding any faster.
+        parallelism = min(max_workers, os.cpu_count() or max_workers)
+        fair_share = (sum(costs) + len(tag_jobs) * TAG_ONLY_COST_S) / parallelism
+
+        segment_counts = []
+        predicted_tasks = [len(batch) * TAG_ONLY_COST_S for batch in tag_batches]
+        for job, cost in zip(other_jobs, costs):
+            segments = 1
+            if cost > fair_share and not uses_stream_copy(job.input_path, job.trim_intro, job.trim_outro, lossless_mp3):
+                duration = self.get_audio_duration(job.input_path, run)
+                segments = max(1, min(parallelism, math.ceil(cost / fair_share), int(duration // SEGMENT_MIN_S)))
+            segment_counts.append(segments)
+            predicted_tasks.extend([cost / segments] * segments)
+        predicted_s = predict_makespan(predicted_tasks, parallelism)
+        split_count = sum(1 for segments in segment_counts if segments > 1)
+        logging.info(f"Predicted batch duration: {format_seconds(predicted_s)}"
+                     + (f", splitting {split_count} long file(s) into parallel segments." if split_count else "."))
+
+        q.put(('progress', f"Processing 0/{total_files} files...", 0))
+        run.progress = BatchProgress(q, total_files, predicted_s)
+
+        results = []
+
+        def report(result):
+            results.append(result)
+            filename = os.path.basename(result["input"])
+            if result["status"] == "ok":
+                logging.info(f"[{len(results)}/{total_files}] Successfully processed {filename}.")
+            elif result["status"] == "failed":
+                logging.error(result["error"])
+            run.progress.file_done()
+            if on_result:
+                on_result(result)
+
+        for result in collided:
+            report(result)
+        for job in skipped:
+            report({"input": job.input_path, "output": job.output_path, "status": "skipped", "error": None, "elapsed_s": 0.0})
+
+        scheduler = Scheduler(max_workers)
+
+        def batch_done(future):
+            for result in future.result():
+                report(result)
+
+        def schedule_split(job, cost, segments):
+            started = time.monotonic()
+            pending = set()
+            errors = []
+
+            def prepared(future):
+                try:
+                    plan = future.result()
+                except Exception as e:
+                    report(self.job_result(job, started, e, lossless_mp3, journal))
+                    return
+                if plan is None:  # Processed whole after all, see prepare_segments.
+                    report(self.job_result(job, started, None, lossless_mp3, journal))
+                    return
+                parts = len(plan.bounds) - 1
+                pending.update(range(parts))
+                for index in range(parts):
+                    scheduler.add(cost / parts, self.encode_segment, job, plan, index, run,
+                                  then=lambda future, index=index: segment_done(plan, index, future))
+
+            def segment_done(plan, index, future):
+                pending.discard(index)
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                if pending:
+                    return
+                if errors:
+                    self.release_segments(plan, run)
+                    report(self.job_result(job, started, errors[0], lossless_mp3, journal))
+                else:
+                    # Joining frees the segment files and finishes the file, so it goes first.
+                    scheduler.add(float("inf"), self.join_segments, job, plan, run,
+                                  then=lambda future: joined(future))
+
+            def joined(future):
+                report(self.job_result(job, started, future.exception(), lossless_mp3, journal))
+
+            scheduler.add(cost, self.prepare_segments, job, run, segments, lossless_mp3, then=prepared)
+
+        for batch in tag_batches:
+            scheduler.add(len(batch) * TAG_ONLY_COST_S, self.process_job_batch, batch, run, lossless_mp3, journal, then=batch_done)
+        for job, cost, segments in zip(other_jobs, costs, segment_counts):
+            if segments > 1:
+                schedule_split(job, cost, segments)
+            else:
+                scheduler.add(cost, self.process_job_batch, [job], run, lossless_mp3, journal, then=batch_done)
+        scheduler.run()
+
+        elapsed = time.monotonic() - run.progress.started
+        logging.info(f"Processing batch finished: {run.progress.audio_seconds / 3600:.2f} audio hours in "
+                     f"{format_seconds(elapsed)} ({run.progress.realtime_multiplier():.1f}x realtime), "
+                     f"predicted {format_seconds(predicted_s)}.")
+        summary = run.timings.summary(run.progress.audio_seconds)
+        summary.update(files=total_files, predicted_wall_s=round(predicted_s, 3),
+                       failed=sum(1 for result in results if result["status"] == "failed"))
+        from instrumentation import format_report
+        logging.info(f"Stage timings:\n{format_report(summary)}")
+        return results, summary
+
+    def job_result(self, job, started, error, lossless_mp3=True, journal=None):
+        """Builds the result dict for a finished job and records it in the journal if given."""
+        result = {"input": job.input_path, "output": job.output_path, "status": "ok", "error": None,
+                  "elapsed_s": round(time.monotonic() - started, 3)}
+        if error is not None:
+            error_message = f"Failed to process {os.path.basename(job.input_path)}: {error}"
+            if isinstance(error, subprocess.CalledProcessError):
+                error_message += f"\n\nffmpeg error:\n{error.stderr}"
+            result.update(status="failed", error=error_message)
+        if journal is not None:
+            journal.record(job, lossless_mp3, "done" if error is None else "failed", result["error"])
+        return result
+
+    def process_job_batch(self, jobs, run, lossless_mp3=True, journal=None):
+        """Runs process_single_file for each job and returns a result dict per job, recording each in the journal if given."""
+        results = []
+        for job in jobs:
+            started = time.monotonic()
+            try:
+                self.process_single_file(job.input_path, job.output_path, job.metadata, job.trim_intro, job.trim_outro, run, lossless_mp3)
+                error = None
+            except Exception as e:
+                error = e
+            results.append(self.job_result(job, started, error, lossless_mp3, journal))
+        return results
+
+    def process_single_file(self, input_path, output_path, metadata, trim_intro, trim_outro, run, lossless_mp3=True, bounds=None):
+        filename = os.path.basename(input_path)
+        is_mp3 = os.path.splitext(input_path)[1].lower() == '.mp3'
+        logging.info(f"Processing details for {filename}: Trim Intro={trim_intro}, Trim Outro={trim_outro}")
+
+        if not trim_intro and not trim_outro:
+            logging.info(f"No trimming required for {filename}. Converting and applying metadata.")
+            if is_mp3:
+                # The audio is untouched, so only the tag header is rewritten: in place,
+                # or on a reflink/copy of the source that already carries its tags.
+                if os.path.abspath(output_path) == os.path.abspath(input_path):
+                    logging.info(f"Updating tags of {filename} in place.")
+                else:
+                    with run.stage("copy"):
+                        reflinked = clone_file(input_path, output_path)
+                    if reflinked:
+                        logging.info(f"Reflinked {filename} to the output folder.")
+                    else:
+                        logging.info(f"Copied {filename} directly as it is an MP3.")
+                run.add_audio(self.get_audio_duration(input_path, run))
+                with run.stage("tags"):
+                    self.write_tags(output_path, metadata)
+                return
+
+        # Everything below produces new audio with ffmpeg. Re-encodes can be skipped by
+        # the output cache when the same input was already processed the same way.
+        if uses_stream_copy(input_path, trim_intro, trim_outro, lossless_mp3):
+            expected_bytes = os.path.getsize(input_path)
+        else:
+            expected_bytes = int(self.get_audio_duration(input_path, run) * MAX_MP3_BYTES_PER_S)
+        with self.staged_output(output_path, expected_bytes, run) as work_path:
+            cache_key, hit = self.reuse_cached_audio(input_path, work_path, metadata, trim_intro, trim_outro, run, lossless_mp3)
+            if hit:
+                return
+
+            self.render_audio(input_path, work_path, trim_intro, trim_outro, run, lossless_mp3, bounds)
+            if cache_key is not None:
+                with run.stage("cache_store"):
+                    run.output_cache.store(cache_key, work_path)
+            with run.stage("tags"):
+                self.apply_metadata_to_file(work_path, metadata, input_path)
+
+    @contextmanager
+    def staged_output(self, output_path, expected_bytes, run):
+        """
+        Yields the path an output should be built at. With a spool that is a file
+        in a spool folder, moved to output_path if the block created it and
+        finished without an error, so the output folder only sees the finished,
+        tagged file. Without one it is output_path itself.
+        """
+        if run.spool is None:
+            yield output_path
+            return
+        with run.spool.reserve(expected_bytes) as work_dir:
+            work_path = os.path.join(work_dir, os.path.basename(output_path))
+            yield work_path
+            if os.path.exists(work_path):
+                with run.stage("publish"):
+                    run.spool.publish(work_path, output_path)
+
+    def reuse_cached_audio(self, input_path, output_path, metadata, trim_intro, trim_outro, run, lossless_mp3=True):
+        """
+        Looks the job up in the output cache and returns (cache_key, hit). On a hit
+        the cached audio is already at output_path with the metadata applied. The
+        key is None when the run has no output cache or the job is a stream copy:
+        copying the source costs about as much as copying a cached entry, and would
+        only fill the cache with duplicates of it.
+        """
+        if run.output_cache is None or uses_stream_copy(input_path, trim_intro, trim_outro, lossless_mp3):
+            return None, False
+        with run.stage("cache_lookup"):
+            cache_key = run.output_cache.key_for(input_path, self.render_params(trim_intro, trim_outro))
+            hit = run.output_cache.fetch(cache_key, output_path)
+        if not hit:
+            return cache_key, False
+        logging.info(f"Reused cached audio for {os.path.basename(input_path)}, only applying metadata.")
+        run.add_audio(self.get_audio_duration(input_path, run))
+        with run.stage("tags"):
+            self.apply_metadata_to_file(output_path, metadata, input_path)
+        return cache_key, True
+
+    def render_params(self, trim_intro, trim_outro):
+        """Everything besides the input's content that decides the audio a re-encode writes."""
+        params = {"trim_intro": bool(trim_intro), "trim_outro": bool(trim_outro), "encoder": "libmp3lame -q:a 2"}
+        if trim_intro or trim_outro:
+            params.update(silence_filter=SILENCE_DETECT_FILTER, trim_window_s=TRIM_WINDOW_S)
+        return params
+
+    def render_audio(self, input_path, output_path, trim_intro, trim_outro, run, lossless_mp3=True, bounds=None):
+        """
+        Writes the converted and/or trimmed audio of input_path to output_path as
+        MP3, without setting tags. bounds, if given, are the (start, end) seconds
+        to keep as already found by detect_silence_boundaries.
+        """
+        filename = os.path.basename(input_path)
+        is_mp3 = os.path.splitext(input_path)[1].lower() == '.mp3'
+
+        if not trim_intro and not trim_outro:
+            logging.info(f"Converting {filename} to MP3.")
+            try:
+                self.run_ffmpeg(
+                    ["ffmpeg", "-y", "-i", input_path, "-codec:a", "libmp3lame", "-q:a", "2", output_path],
+                    run, f"{filename}: Converting to MP3", self.get_audio_duration(input_path, run), "encode"
+                )
+            finally:
+                run.q.put(('sub_task_end',))
+            return
+
+        duration = self.get_audio_duration(input_path, run)
+        if duration == 0:
+            raise ValueError("Could not get audio duration.")
+
+        run.q.put(('sub_task_start', f"{filename}: Detecting silence...", 1))
+        try:
+            if bounds is None:
+                bounds = self.detect_silence_boundaries(input_path, duration, trim_intro, trim_outro, run)
+            start_s, end_s = bounds
+            logging.info(f"Keeping {start_s:.3f}s to {end_s:.3f}s of {filename} ({duration:.2f}s total).")
+            run.q.put(('sub_task_progress', 1))
+
+            if is_mp3 and lossless_mp3:
+                # Output-side -ss/-t with stream copy drops whole MP3 frames before and
+                # after the cut points, so nothing is re-encoded.
+                logging.info(f"Cutting {filename} losslessly with stream copy.")
+                cmd = ["ffmpeg", "-y", "-i", input_path]
+                if start_s > 0:
+                    cmd.extend(["-ss", f"{start_s:.3f}"])
+                if end_s < duration:
+                    cmd.extend(["-to", f"{end_s:.3f}"])
+                cmd.extend(["-map", "0:a:0", "-c", "copy", output_path])
+                label = f"{filename}: Cutting"
+                stage = "cut"
+            else:
+                cmd = ["ffmpeg", "-y"]
+                if start_s > 0:
+                    cmd.extend(["-ss", f"{start_s:.3f}"])
+                cmd.extend(["-i", input_path])
+                if end_s < duration:
+                    cmd.extend(["-t", f"{end_s - start_s:.3f}"])
+                cmd.extend(["-map", "0:a:0", "-codec:a", "libmp3lame", "-q:a", "2", output_path])
+                label = f"{filename}: Encoding"
+                stage = "encode"
+            self.run_ffmpeg(cmd, run, label, end_s - start_s, stage)
+        finally:
+            run.q.put(('sub_task_end',))
+
+    def prepare_segments(self, job, run, segments, lossless_mp3=True):
+        """
+        Finds the trim boundaries of a job and up to segments - 1 split points in
+        silences between them, and returns a SegmentPlan for encode_segment and
+        join_segments. Returns None instead if the job was finished here: served
+        from the output cache, or processed whole because no usable split point
+        was found.
+        """
+        input_path = job.input_path
+        filename = os.path.basename(input_path)
+        with self.staged_output(job.output_path, int(self.get_audio_duration(input_path, run) * MAX_MP3_BYTES_PER_S), run) as work_path:
+            cache_key, hit = self.reuse_cached_audio(input_path, work_path, job.metadata, job.trim_intro, job.trim_outro, run, lossless_mp3)
+        if hit:
+            return None
+
+        duration = self.get_audio_duration(input_path, run)
+        if duration == 0:
+            raise ValueError("Could not get audio duration.")
+        start_s, end_s = 0.0, duration
+        if job.trim_intro or job.trim_outro:
+            run.q.put(('sub_task_start', f"{filename}: Detecting silence...", 1))
+            try:
+                start_s, end_s = self.detect_silence_boundaries(input_path, duration, job.trim_intro, job.trim_outro, run)
+            finally:
+                run.q.put(('sub_task_end',))
+
+        sample_rate = probe_sample_rate(input_path)
+        bounds = [start_s, end_s]
+        if sample_rate in MP3_SAMPLE_RATES:
+            # MPEG-1 layer III frames hold 1152 samples, the MPEG-2/2.5 ones below 32 kHz 576.
+            frame_s = (1152 if sample_rate >= 32000 else 576) / sample_rate
+            bounds = self.find_split_points(input_path, start_s, end_s, segments, frame_s, run)
+        if len(bounds) < 3:
+            logging.info(f"No split points found in {filename}, encoding it in one piece.")
+            self.process_single_file(input_path, job.output_path, job.metadata, job.trim_intro, job.trim_outro, run,
+                                     lossless_mp3, (start_s, end_s))
+            return None
+
+        logging.info(f"Encoding {filename} in {len(bounds) - 1} parallel segments split at "
+                     + ", ".join(format_seconds(t) for t in bounds[1:-1]) + ".")
+        if run.spool is not None:
+            # Room for the parts and the joined file, plus encodes still being cut.
+            temp_dir = run.spool.acquire(int((end_s - start_s) * MAX_MP3_BYTES_PER_S * 3))
+        else:
+            temp_dir = tempfile.mkdtemp(prefix=".bulkaudio-", dir=os.path.dirname(os.path.abspath(job.output_path)))
+        return SegmentPlan(cache_key, bounds, frame_s, temp_dir)
+
+    def release_segments(self, plan, run):
+        """Deletes the temp folder of a SegmentPlan."""
+        if run.spool is not None:
+            run.spool.release(plan.temp_dir)
+        else:
+            shutil.rmtree(plan.temp_dir, ignore_errors=True)
+
+    def find_split_points(self, input_path, start_s, end_s, segments, frame_s, run):
+        """
+        Returns the segment bounds from start_s to end_s, with split points in the
+        middle of silences near evenly spaced targets, snapped to the MP3 frame
+        grid counted from start_s. Targets without a nearby silence are dropped.
+        """
+        bounds = [start_s]
+        for i in range(1, segments):
+            target = start_s + (end_s - start_s) * i / segments
+            window_start = max(start_s, target - SPLIT_SEARCH_S)
+            best = None
+            silence_start = None
+            for kind, timestamp in self._silence_events(input_path, run, window_start, 2 * SPLIT_SEARCH_S):
+                if kind == 'start':
+                    silence_start = timestamp
+                elif kind == 'end' and silence_start is not None:
+                    if timestamp - silence_start >= SPLIT_SILENCE_MIN_S:
+                        middle = (silence_start + timestamp) / 2
+                        if best is None or abs(middle - target) < abs(best - target):
+                            best = middle
+                    silence_start = None
+            if best is None:
+                continue
+            split = start_s + round((best - start_s) / frame_s) * frame_s
+            if bounds[-1] < split < end_s:
+                bounds.append(split)
+        bounds.append(end_s)
+        return bounds
+
+    def encode_segment(self, job, plan, index, run):
+        """
+        Encodes segment index of a SegmentPlan to part_NNN.mp3 in its temp folder.
+        The encode starts and ends SEGMENT_OVERLAP_FRAMES early and late so the
+        encoder's priming and padding fall outside the segment, and the overlap
+        is then cut off with stream copy on whole frames.
+        """
+        filename = os.path.basename(job.input_path)
+        start_s, end_s = plan.bounds[index], plan.bounds[index + 1]
+        overlap_s = SEGMENT_OVERLAP_FRAMES * plan.frame_s
+        encode_start = max(plan.bounds[0], start_s - overlap_s)
+        encode_end = min(plan.bounds[-1], end_s + overlap_s)
+        encoded = os.path.join(plan.temp_dir, f"encoded_{index:03d}.mp3")
+        part = os.path.join(plan.temp_dir, f"part_{index:03d}.mp3")
+
+        cmd = ["ffmpeg", "-y"]
+        if encode_start > 0:
+            cmd.extend(["-ss", f"{encode_start:.6f}"])
+        cmd.extend(["-i", job.input_path, "-t", f"{encode_end - encode_start:.6f}",
+                    "-map", "0:a:0", "-codec:a", "libmp3lame", "-q:a", "2", encoded])
+        label = f"{filename}: Encoding part {index + 1}/{len(plan.bounds) - 1}"
+        try:
+            self.run_ffmpeg(cmd, run, label, encode_end - encode_start, "encode")
+        finally:
+            run.q.put(('sub_task_end',))
+
+        cmd = ["ffmpeg", "-y", "-i", encoded]
+        if start_s > encode_start:
+            cmd.extend(["-ss", f"{start_s - encode_start:.6f}"])
+        if end_s < encode_end:
+            cmd.extend(["-to", f"{end_s - encode_start:.6f}"])
+        cmd.extend(["-map", "0:a:0", "-c", "copy", part])
+        self.run_command(cmd, run, "segment_cut")
+        os.remove(encoded)
+
+    def join_segments(self, job, plan, run):
+        """
+        Concatenates the encoded segments of a SegmentPlan into the job's output,
+        then tags and caches it. With a spool the joined file is built next to the
+        parts and only published to the output folder once tagged.
+        """
+        filename = os.path.basename(job.input_path)
+        try:
+            list_path = os.path.join(plan.temp_dir, "parts.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                for index in range(len(plan.bounds) - 1):
+                    f.write(f"file 'part_{index:03d}.mp3'\n")
+            work_path = job.output_path
+            if run.spool is not None:
+                work_path = os.path.join(plan.temp_dir, os.path.basename(job.output_path))
+            cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-map", "0:a:0", "-c", "copy", work_path]
+            logging.info(f"Joining {len(plan.bounds) - 1} segments of {filename}.")
+            self.run_command(cmd, run, "join")
+            for index in range(len(plan.bounds) - 1):
+                os.remove(os.path.join(plan.temp_dir, f"part_{index:03d}.mp3"))
+
+            if plan.cache_key is not None:
+                with run.stage("cache_store"):
+                    run.output_cache.store(plan.cache_key, work_path)
+            with run.stage("tags"):
+                self.apply_metadata_to_file(work_path, job.metadata, job.input_path)
+            if work_path != job.output_path:
+                with run.stage("publish"):
+                    run.spool.publish(work_path, job.output_path)
+        finally:
+            self.release_segments(plan, run)
+
+    def run_ffmpeg(self, cmd, run, label, expected_s, stage="encode"):
+        """
+        Runs an ffmpeg command with -progress output on a pipe and reports the
+        output position, speed and ETA as sub-task progress at most every
+        PROGRESS_REPORT_INTERVAL_S. Returns the final output time in seconds and
+        raises CalledProcessError with ffmpeg's stderr if it fails. The run is
+        timed as the given stage.
+        """
+        cmd = [cmd[0], "-nostats", "-progress", "pipe:1"] + cmd[1:]
+        logging.debug(f"Running ffmpeg command: {' '.join(cmd)}")
+        run.q.put(('sub_task_start', f"{label}...", max(expected_s, 1)))
+
+        out_time = 0.0
+        speed = None
+        last_report = 0.0
+        # stderr goes to a file rather than a pipe so a chatty ffmpeg can never block on it.
+        with tempfile.TemporaryFile() as stderr_file, run.stage(stage, child=True) as child:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, text=True)
+            try:
+                for line in proc.stdout:
+                    key, _, value = line.strip().partition("=")
+                    if key == "out_time_us":
+                        try:
+                            position = int(value) / 1_000_000
+                        except ValueError:
+                            continue  # "N/A" before the first packet is written
+                        if position > out_time:
+                            run.add_audio(position - out_time)
+                            out_time = position
+                    elif key == "speed":
+                        try:
+                            speed = float(value.rstrip("x"))
+                        except ValueError:
+                            speed = None
+                    elif key == "progress":
+                        now = time.monotonic()
+                        if value == "end" or now - last_report >= PROGRESS_REPORT_INTERVAL_S:
+                            last_report = now
+                            run.q.put(('sub_task_progress', out_time, self.format_progress(label, out_time, expected_s, speed)))
+                returncode = child.wait(proc)
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                    child.wait(proc)
+                proc.stdout.close()
+            if returncode != 0:
+                stderr_file.seek(0)
+                raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr_file.read().decode(errors="replace"))
+        return out_time
+
+    def format_progress(self, label, out_time, expected_s, speed):
+        text = f"{label}: {format_seconds(out_time)} / {format_seconds(expected_s)}"
+        if speed:
+            remaining_s = max(expected_s - out_time, 0) / speed
+            text += f" at {speed:.1f}x, ETA {format_seconds(remaining_s)}"
+        return text
+
+    def detect_silence_boundaries(self, input_path, duration, trim_intro, trim_outro, run):
+        """
+        Returns the (start, end) timestamps in seconds of the audio to keep once
+        leading and/or trailing silence is dropped. Only the intro and outro windows
+        are decoded, and ffmpeg's silencedetect streams through them, so memory use
+        does not depend on the window length.
+        """
+        start_s, end_s = 0.0, duration
+        if trim_intro:
+            start_s = self._find_leading_silence_end(input_path, min(TRIM_WINDOW_S, duration), run)
+        if trim_outro:
+            offset = max(0.0, duration - TRIM_WINDOW_S)
+            trailing_start = self._find_trailing_silence_start(input_path, offset, run)
+            if trailing_start is not None:
+                end_s = trailing_start
+        if end_s <= start_s:
+            raise ValueError("No audio left after trimming silence.")
+        return start_s, end_s
+
+    def _find_leading_silence_end(self, input_path, window_s, run):
+        for kind, timestamp in self._silence_events(input_path, run, 0, window_s):
+            if kind == 'start' and timestamp > SILENCE_EDGE_TOLERANCE_S:
+                return 0.0  # The first silence starts after some audio, nothing to trim.
+            if kind in ('end', 'eof'):
+                return timestamp if kind == 'end' else 0.0
+        return 0.0
+
+    def _find_trailing_silence_start(self, input_path, offset_s, run):
+        silence_start = None
+        silence_end = None
+        for kind, timestamp in self._silence_events(input_path, run, offset_s):
+            if kind == 'start':
+                silence_start, silence_end = timestamp, None
+            elif kind == 'end':
+                silence_end = timestamp
+            elif kind == 'eof':
+                # silencedetect closes a silence that runs into the end of the stream
+                # with a final silence_end at the last decoded timestamp.
+                if silence_start is not None and silence_end is not None and silence_end >= timestamp - SILENCE_EDGE_TOLERANCE_S:
+                    return silence_start
+        return None
+
+    def _silence_events(self, input_path, run, offset_s, length_s=None):
+        """
+        Runs ffmpeg's silencedetect over part of a file and yields ('start', t),
+        ('end', t) and finally ('eof', t) events with absolute timestamps. Closing
+        the generator early stops the ffmpeg process.
+        """
+        cmd = ["ffmpeg", "-hide_banner", "-nostats"]
+        if offset_s > 0:
+            cmd.extend(["-ss", f"{offset_s:.3f}"])
+        if length_s is not None:
+            cmd.extend(["-t", f"{length_s:.3f}"])
+        cmd.extend(["-i", input_path, "-map", "0:a:0", "-af", SILENCE_DETECT_FILTER, "-f", "null", "-"])
+        logging.debug(f"Running ffmpeg command: {' '.join(cmd)}")
+
+        with run.stage("silence_detect", child=True) as child:
+            yield from self._read_silence_events(cmd, offset_s, child)
+
+    def _read_silence_events(self, cmd, offset_s, child):
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+        stderr_tail = []
+        decoded_until = None
+        try:
+            for line in proc.stderr:
+                stderr_tail = (stderr_tail + [line])[-20:]
+                match = SILENCE_EVENT_RE.search(line)
+                if match:
+                    yield match.group(1), offset_s + float(match.group(2))
+                    continue
+                match = FFMPEG_TIME_RE.search(line)
+                if match:
+                    hours, minutes, seconds = match.groups()
+                    decoded_until = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+            if child.wait(proc) != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd, stderr="".join(stderr_tail))
+            if decoded_until is not None:
+                yield 'eof', offset_s + decoded_until
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                child.wait(proc)
+            proc.stderr.close()
+
+    def apply_metadata_to_file(self, file_path, metadata, original_path):
+        # mutagen is imported on first use to keep it out of the editor's startup.
+        import mutagen
+        filename = os.path.basename(file_path)
+        logging.info(f"Applying metadata to {filename}.")
+        audio = mutagen.File(file_path, easy=True)
+        if audio.tags is None:
+            logging.info(f"No existing tags found for {filename}, creating new ones.")
+            audio.add_tags()
+
+        # Copy all tags from original file first to preserve them
+        try:
+            logging.debug(f"Copying existing tags from {os.path.basename(original_path)}.")
+            original_audio = mutagen.File(original_path, easy=True)
+            if original_audio and original_audio.tags:
+                audio.tags.clear()
+                for key, value in original_audio.tags.items():
+                    try:
+                        audio.tags[key] = value
+                    except KeyError:
+                        # Vorbis comments and MP4 atoms can have fields ID3 has no frame for.
+                        logging.debug(f"Not copying {key} from {os.path.basename(original_path)}, ID3 has no such tag.")
+        except Exception as e:
+            logging.warning(f"Could not copy tags from {original_path}: {e}")
+
+        # Apply changes from GUI
+        logging.debug(f"Applying new metadata to {filename}: {metadata}")
+        for key, tag in TAG_FIELDS.items():
+            audio[tag] = metadata.get(key, '')
+        audio.save()
+        logging.info(f"Metadata saved for {filename}.")
+
+    def write_tags(self, file_path, metadata):
+        """
+        Sets the table's tag fields on a file that already carries the rest of its
+        tags, saving only if something changed. mutagen rewrites just the tag
+        header when the new tags fit in the existing padding.
+        """
+        import mutagen
+        filename = os.path.basename(file_path)
+        audio = mutagen.File(file_path, easy=True)
+        if audio.tags is None:
+            logging.info(f"No existing tags found for {filename}, creating new ones.")
+            audio.add_tags()
+
+        changed = False
+        for key, tag in TAG_FIELDS.items():
+            value = metadata.get(key, '')
+            if audio.tags.get(tag, ['']) != [value]:
+                audio[tag] = value
+                changed = True
+        if changed:
+            audio.save()
+            logging.info(f"Metadata saved for {filename}.")
+        else:
+            logging.info(f"Metadata of {filename} is unchanged, nothing to write.")
@@ -0,0 +1,174 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from probe_cache import default_cache_dir
+
+try:
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+except (AttributeError, ValueError, OSError):  # Windows
+    CLOCK_TICKS = None
+
+
+def _proc_usage(proc_dir):
+    """
+    Reads (cpu_s, bytes_read, bytes_written) for a process or thread from its
+    /proc folder, or returns None where /proc is not available. Bytes are the
+    logical reads and writes the task made, whether or not they hit the disk.
+    """
+    if CLOCK_TICKS is None:
+        return None
+    try:
+        with open(os.path.join(proc_dir, "stat")) as f:
+            # The command name in parentheses may contain spaces, so split after it.
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(os.path.join(proc_dir, "io")) as f:
+            io = dict(line.split(": ", 1) for line in f.read().splitlines())
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, int(io["rchar"]), int(io["wchar"])
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+
+
+def wait_child(proc):
+    """
+    Waits for a subprocess.Popen child to exit and returns its (cpu_s,
+    bytes_read, bytes_written), or None if the OS does not expose them. On Linux
+    the exited child is inspected before it is reaped, so the numbers are its
+    own and not mixed with other children running at the same time.
+    """
+    usage = None
+    if CLOCK_TICKS is not None and hasattr(os, "waitid"):
+        try:
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            usage = _proc_usage(f"/proc/{proc.pid}")
+        except ChildProcessError:
+            pass
+    proc.wait()
+    return usage
+
+
+def _thread_usage():
+    usage = _proc_usage(f"/proc/self/task/{threading.get_native_id()}")
+    if usage is None:
+        return time.thread_time(), None, None
+    return usage
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class StageTimings:
+    """
+    Collects one sample per pipeline stage run (an ffprobe, silence detection,
+    encode, tag write and so on) from all worker threads: wall time, CPU time and
+    bytes read and written. CPU and bytes are None where the OS does not expose
+    them.
+    """
+
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def add(self, stage, wall_s, usage=None):
+        cpu_s, bytes_read, bytes_written = usage if usage is not None else (None, None, None)
+        with self._lock:
+            self._samples[stage].append((wall_s, cpu_s, bytes_read, bytes_written))
+
+    @contextmanager
+    def process(self, stage):
+        """
+        Times a child process. Yields a ChildWaiter, and the child must be waited
+        for with its wait method so the child's own usage is recorded along with
+        the stage's wall time.
+        """
+        started = time.monotonic()
+        waiter = ChildWaiter()
+        try:
+            yield waiter
+        finally:
+            self.add(stage, time.monotonic() - started, waiter.usage)
+
+    @contextmanager
+    def thread(self, stage):
+        """Times work done on the calling thread, such as tag writes and hashing."""
+        started = time.monotonic()
+        before = _thread_usage()
+        try:
+            yield
+        finally:
+            after = _thread_usage()
+            usage = tuple(None if a is None or b is None else b - a for a, b in zip(before, after))
+            self.add(stage, time.monotonic() - started, usage)
+
+    def summary(self, audio_seconds):
+        """Per-stage counts, totals and wall time p50/p95, plus overall throughput, as a JSON-ready dict."""
+        wall_s = time.monotonic() - self.started
+        stages = {}
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items()}
+        for stage, values in samples.items():
+            walls = [value[0] for value in values]
+            totals = []
+            for column in (1, 2, 3):
+                known = [value[column] for value in values if value[column] is not None]
+                totals.append(sum(known) if known else None)
+            stages[stage] = {
+                "count": len(values),
+                "wall_total_s": round(sum(walls), 3),
+                "wall_p50_s": round(percentile(walls, 0.50), 3),
+                "wall_p95_s": round(percentile(walls, 0.95), 3),
+                "cpu_total_s": None if totals[0] is None else round(totals[0], 3),
+                "bytes_read": totals[1],
+                "bytes_written": totals[2],
+            }
+        audio_hours = audio_seconds / 3600
+        return {
+            "wall_s": round(wall_s, 3),
+            "audio_hours": round(audio_hours, 4),
+            "audio_hours_per_wall_hour": round(audio_hours / (wall_s / 3600), 2) if wall_s > 0 else None,
+            "stages": stages,
+        }
+
+
+class ChildWaiter:
+    """Waits for child processes with wait_child and keeps the usage of the last one."""
+    usage = None
+
+    def wait(self, proc):
+        self.usage = wait_child(proc)
+        return proc.returncode
+
+
+def default_report_path():
+    """A new timestamped report file in the user cache folder."""
+    return os.path.join(default_cache_dir(), "reports", time.strftime("run-%Y%m%d-%H%M%S.json"))
+
+
+def write_report(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+
+def format_report(report):
+    """Renders a summary from StageTimings.summary as a fixed-width text table."""
+    def megabytes(value):
+        return "-" if value is None else f"{value / (1024 * 1024):.1f}"
+
+    lines = [f"{'Stage':<16}{'Runs':>6}{'p50 s':>9}{'p95 s':>9}{'Wall s':>10}{'CPU s':>10}{'Read MB':>10}{'Write MB':>10}"]
+    for stage, row in sorted(report["stages"].items(), key=lambda item: -item[1]["wall_total_s"]):
+        cpu = "-" if row["cpu_total_s"] is None else f"{row['cpu_total_s']:.2f}"
+        lines.append(f"{stage:<16}{row['count']:>6}{row['wall_p50_s']:>9.2f}{row['wall_p95_s']:>9.2f}"
+                     f"{row['wall_total_s']:>10.2f}{cpu:>10}{megabytes(row['bytes_read']):>10}{megabytes(row['bytes_written']):>10}")
+    rate = report["audio_hours_per_wall_hour"]
+    lines.append(f"{report['audio_hours']:.2f} audio hours in {report['wall_s']:.1f}s"
+                 + (f" = {rate:.1f} audio hours per wall hour" if rate is not None else ""))
+    return "\n".join(lines)
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from probe_cache import default_cache_dir
+
+
+def job_params_hash(job, lossless_mp3):
+    """Hashes everything that decides what a job writes: the input path, trim flags, encode mode and tags."""
+    params = {
+        "input": os.path.abspath(job.input_path),
+        "trim_intro": bool(job.trim_intro),
+        "trim_outro": bool(job.trim_outro),
+        "lossless_mp3": bool(lossless_mp3),
+        "metadata": job.metadata,
+    }
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _fingerprint(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class JobJournal:
+    """
+    Records every processed output in an SQLite database, keyed by output path,
+    with the input's (size, mtime) fingerprint, a hash of the job parameters
+    (see job_params_hash) and the output's own fingerprint once it is written.
+    An output counts as done only while all of these still match, so a batch
+    that was interrupted or partly failed can be re-run and picks up where it
+    stopped, while outputs whose input, trim settings or tags changed since are
+    processed again.
+    """
+
+    def __init__(self, db_path=None):
+        self._lock = threading.Lock()
+        if db_path is None:
+            db_path = os.path.join(default_cache_dir(), "job_journal.sqlite3")
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "output TEXT PRIMARY KEY, input TEXT, input_size INTEGER, input_mtime_ns INTEGER, "
+            "params TEXT, status TEXT, output_size INTEGER, output_mtime_ns INTEGER, error TEXT, updated REAL)"
+        )
+        self._db.commit()
+        logging.debug(f"Using job journal at {db_path}.")
+
+    def is_done(self, job, lossless_mp3):
+        """True if the job's output was completed with the same input and parameters and is unchanged since."""
+        output = os.path.abspath(job.output_path)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT input_size, input_mtime_ns, params, status, output_size, output_mtime_ns FROM jobs WHERE output = ?",
+                (output,)
+            ).fetchone()
+        if not row or row[3] != "done":
+            return False
+        try:
+            if _fingerprint(job.input_path) != (row[0], row[1]) or _fingerprint(output) != (row[4], row[5]):
+                return False
+        except OSError:
+            return False
+        return row[2] == job_params_hash(job, lossless_mp3)
+
+    def mark_pending(self, jobs, lossless_mp3):
+        """Records jobs as pending in one transaction, before any of them start."""
+        now = time.time()
+        rows = [(os.path.abspath(job.output_path), os.path.abspath(job.input_path), job_params_hash(job, lossless_mp3), now)
+                for job in jobs]
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO jobs (output, input, params, status, updated) VALUES (?, ?, ?, 'pending', ?) "
+                "ON CONFLICT(output) DO UPDATE SET input = excluded.input, params = excluded.params, "
+                "status = 'pending', error = NULL, updated = excluded.updated",
+                rows
+            )
+            self._db.commit()
+
+    def record(self, job, lossless_mp3, status, error=None):
+        """Stores the outcome of a job. For done jobs both fingerprints are taken now, after the output was written."""
+        input_fp = output_fp = (None, None)
+        if status == "done":
+            try:
+                input_fp = _fingerprint(job.input_path)
+                output_fp = _fingerprint(job.output_path)
+            except OSError as e:
+                status, error = "failed", f"Output missing after processing: {e}"
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (os.path.abspath(job.output_path), os.path.abspath(job.input_path), input_fp[0], input_fp[1],
+                     job_params_hash(job, lossless_mp3), status, output_fp[0], output_fp[1], error, time.time())
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Could not record {job.output_path} in the job journal: {e}")
@@ -0,0 +1,71 @@
+import os
+import fnmatch
+import logging
+
+
+def _matches(name, rel_path, patterns):
+    """Patterns containing a '/' match the path relative to the scan root, the rest match the entry name."""
+    for pattern in patterns:
+        target = rel_path if "/" in pattern else name
+        if fnmatch.fnmatch(target.lower(), pattern.lower()):
+            return True
+    return False
+
+
+def scan_audio_files(root, include=("*",), exclude=(), min_size=0, recursive=True, follow_symlinks=False):
+    """
+    Walks a folder with os.scandir and yields (path, size) for every file that
+    matches one of the include globs, matches none of the exclude globs and is at
+    least min_size bytes. Entries are yielded as they are found, so callers can
+    start working before the walk finishes. Directories matching an exclude glob
+    are skipped entirely. Symlinks are ignored unless follow_symlinks is set, in
+    which case directories already visited are skipped to avoid loops.
+    """
+    include = [p.strip() for p in include if p.strip()] or ["*"]
+    exclude = [p.strip() for p in exclude if p.strip()]
+    visited = set()
+    # Depth-first with an explicit stack of (directory, path relative to root).
+    stack = [(root, "")]
+    while stack:
+        directory, rel_dir = stack.pop()
+        if follow_symlinks:
+            try:
+                st = os.stat(directory)
+            except OSError as e:
+                logging.warning(f"Could not stat {directory}: {e}")
+                continue
+            if (st.st_dev, st.st_ino) in visited:
+                logging.debug(f"Skipping already visited directory {directory}.")
+                continue
+            visited.add((st.st_dev, st.st_ino))
+
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            logging.warning(f"Could not scan {directory}: {e}")
+            continue
+
+        subdirs = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_symlink() and not follow_symlinks:
+                    continue
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if recursive and not _matches(entry.name, rel_path, exclude):
+                        subdirs.append((entry.path, rel_path))
+                    continue
+                if not entry.is_file(follow_symlinks=follow_symlinks):
+                    continue
+                if not _matches(entry.name, rel_path, include) or _matches(entry.name, rel_path, exclude):
+                    continue
+                size = entry.stat(follow_symlinks=follow_symlinks).st_size
+            except OSError as e:
+                logging.warning(f"Could not read {entry.path}: {e}")
+                continue
+            if size >= min_size:
+                yield entry.path, size
+
+        # Reversed so the stack pops subdirectories in name order.
+        stack.extend(reversed(subdirs))
@@ -1,16 +1,36 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
-import mutagen
-from mutagen.easyid3 import EasyID3
 import threading
-import tempfile
 import subprocess
-import shutil
-import math
 import queue
 import sys
 import logging
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from engine import AudioProcessor, is_tag_only, plan_job
+from dependencies import find_missing_dependencies
+from library_scan import scan_audio_files
+from table_model import AudioRow, TableModel, COLUMNS, TEXT_COLUMNS, CHECKBOX_COLUMNS
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.ogg', '.opus')
+DEFAULT_INCLUDE_GLOBS = ";".join(f"*{ext}" for ext in AUDIO_EXTENSIONS)
+# Folder loading adds every row that arrived since the last UI tick; the model only
+# appends them and render_rows redraws just the visible window, so ticks stay short.
+LOAD_POLL_MS = 50
+# Height of a Treeview row in pixels, used to work out how many rows fit on screen.
+TREE_ROW_HEIGHT = 20
+TREE_HEADING_HEIGHT = 25
+# How often the progress window drains worker messages and redraws.
+PROGRESS_POLL_MS = 50
+DEPENDENCY_POLL_MS = 100
+
+# The processing settings chosen in the window when Process Files was clicked.
+BatchOptions = namedtuple("BatchOptions", ["output_folder", "source_folder", "max_workers", "lossless_mp3", "tags_in_place",
+                                           "skip_completed", "stage_outputs", "cache_outputs"])
+
 
 class AudioMetadataEditor(tk.Tk):
     def __init__(self):
@@ -18,7 +38,20 @@ class AudioMetadataEditor(tk.Tk):
         self.title("Audiobook Metadata Editor")
         self.geometry("1200x600")
 
-        self.file_paths = {}
+        self.model = TableModel()
+        self.view_offset = 0
+        self.visible_row_count = 30
+        self.processor = AudioProcessor()
+        # Opened with the first batch that has caching on, see process_items.
+        self.output_cache = None
+        self.output_cache_opened = False
+        # Set while a batch runs; Process Files stays disabled until it completes.
+        self.processing = False
+        self.missing_dependencies = []
+        self.load_queue = None
+        self.load_cancel_event = None
+        # The folder the table was loaded from; outputs keep the subfolders below it.
+        self.source_folder = None
 
         self.tree_frame = ttk.Frame(self)
         self.tree_frame.pack(pady=10, padx=10, fill="both", expand=True)
@@ -28,30 +61,44 @@ class AudioMetadataEditor(tk.Tk):
         self.tree_scroll_x = ttk.Scrollbar(self.tree_frame, orient="horizontal")
         self.tree_scroll_x.pack(side="bottom", fill="x")
 
-        self.tree = ttk.Treeview(self.tree_frame, yscrollcommand=self.tree_scroll_y.set, xscrollcommand=self.tree_scroll_x.set, show='headings')
+        # The Treeview only ever holds the rows currently on screen. The vertical
+        # scrollbar drives self.view_offset into the table model instead of the
+        # Treeview's own scrolling, see render_rows.
+        self.tree = ttk.Treeview(self.tree_frame, xscrollcommand=self.tree_scroll_x.set, show='headings')
         self.tree.pack(fill="both", expand=True)
 
-        self.tree_scroll_y.config(command=self.tree.yview)
+        self.tree_scroll_y.config(command=self.on_scroll)
         self.tree_scroll_x.config(command=self.tree.xview)
+        self.tree.bind("<Configure>", self.on_tree_resize)
+        self.tree.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.tree.bind("<Button-4>", self.on_mouse_wheel)
+        self.tree.bind("<Button-5>", self.on_mouse_wheel)
 
-        self.columns = {
-            "file_name": "File Name",
-            "file_size": "File Size (MB)",
-            "duration": "Duration (s)",
-            "title": "Title",
-            "artist": "Contributing Artist(s)",
-            "album_artist": "Album Artist",
-            "album": "Album",
-            "track_number": "Track #",
-            "trim_intro": "Trim Intro",
-            "trim_outro": "Trim Outro"
-        }
+        self.columns = COLUMNS
         self.tree["columns"] = list(self.columns.keys())
 
         for col_id, col_text in self.columns.items():
             self.tree.heading(col_id, text=col_text, command=lambda _col=col_id: self.sort_column(_col, False))
             self.tree.column(col_id, width=100)
 
+        # Options for how Open Folder scans the chosen directory.
+        self.scan_frame = ttk.Frame(self)
+        self.scan_frame.pack(pady=(10, 0))
+
+        self.recursive_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(self.scan_frame, text="Include subfolders", variable=self.recursive_var).pack(side="left", padx=5)
+        ttk.Label(self.scan_frame, text="Include:").pack(side="left", padx=(10, 2))
+        self.include_var = tk.StringVar(value=DEFAULT_INCLUDE_GLOBS)
+        ttk.Entry(self.scan_frame, textvariable=self.include_var, width=40).pack(side="left")
+        ttk.Label(self.scan_frame, text="Exclude:").pack(side="left", padx=(10, 2))
+        self.exclude_var = tk.StringVar(value="")
+        ttk.Entry(self.scan_frame, textvariable=self.exclude_var, width=20).pack(side="left")
+        ttk.Label(self.scan_frame, text="Min size (KB):").pack(side="left", padx=(10, 2))
+        self.min_size_var = tk.StringVar(value="0")
+        ttk.Entry(self.scan_frame, textvariable=self.min_size_var, width=7).pack(side="left")
+        self.follow_symlinks_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.scan_frame, text="Follow symlinks", variable=self.follow_symlinks_var).pack(side="left", padx=(10, 5))
+
         self.button_frame = ttk.Frame(self)
         self.button_frame.pack(pady=10)
 
@@ -61,76 +108,292 @@ class AudioMetadataEditor(tk.Tk):
         self.process_button = ttk.Button(self.button_frame, text="Process Files", command=self.process_files)
         self.process_button.pack(side="left", padx=5)
 
+        # Number of files processed concurrently. Each job is mostly an ffmpeg
+        # subprocess, so one job per core keeps the machine busy.
+        ttk.Label(self.button_frame, text="Parallel jobs:").pack(side="left", padx=(15, 2))
+        self.max_workers_var = tk.IntVar(value=os.cpu_count() or 1)
+        self.max_workers_spinbox = ttk.Spinbox(self.button_frame, from_=1, to=64, width=4, textvariable=self.max_workers_var)
+        self.max_workers_spinbox.pack(side="left")
+
+        # Trimmed MP3s are cut on frame boundaries with stream copy instead of being re-encoded.
+        self.lossless_mp3_var = tk.BooleanVar(value=True)
+        self.lossless_mp3_check = ttk.Checkbutton(self.button_frame, text="Lossless MP3 trims", variable=self.lossless_mp3_var)
+        self.lossless_mp3_check.pack(side="left", padx=(15, 0))
+
+        # Untrimmed MP3s get their tags rewritten where they are instead of being copied to the output folder.
+        self.tags_in_place_var = tk.BooleanVar(value=False)
+        self.tags_in_place_check = ttk.Checkbutton(self.button_frame, text="Retag MP3s in place", variable=self.tags_in_place_var)
+        self.tags_in_place_check.pack(side="left", padx=(15, 0))
+
+        self.skip_completed_var = tk.BooleanVar(value=True)
+        self.skip_completed_check = ttk.Checkbutton(self.button_frame, text="Skip completed outputs", variable=self.skip_completed_var)
+        self.skip_completed_check.pack(side="left", padx=(15, 0))
+
+        self.stage_outputs_var = tk.BooleanVar(value=False)
+        self.stage_outputs_check = ttk.Checkbutton(self.button_frame, text="Stage outputs locally", variable=self.stage_outputs_var)
+        self.stage_outputs_check.pack(side="left", padx=(15, 0))
+
+        # Re-encoded audio is kept in the output cache, so processing the same sources the same way again skips ffmpeg.
+        self.cache_outputs_var = tk.BooleanVar(value=False)
+        self.cache_outputs_check = ttk.Checkbutton(self.button_frame, text="Cache encoded audio", variable=self.cache_outputs_var)
+        self.cache_outputs_check.pack(side="left", padx=(15, 0))
+
+        ttk.Label(self.button_frame, text="Filter:").pack(side="left", padx=(15, 2))
+        self.filter_var = tk.StringVar(value="")
+        self.filter_var.trace_add("write", lambda *_: self.apply_filter())
+        ttk.Entry(self.button_frame, textvariable=self.filter_var, width=25).pack(side="left")
+
+        # Folder loading status, only shown while a folder is being loaded.
+        self.load_frame = ttk.Frame(self)
+        self.load_label = ttk.Label(self.load_frame, text="")
+        self.load_label.pack(side="left", padx=5)
+        self.load_progress_bar = ttk.Progressbar(self.load_frame, orient="horizontal", length=300, mode="indeterminate")
+        self.load_progress_bar.pack(side="left", padx=5)
+        self.cancel_load_button = ttk.Button(self.load_frame, text="Cancel", command=self.cancel_load)
+        self.cancel_load_button.pack(side="left", padx=5)
+
         self.tree.bind("<Double-1>", self.on_double_click)
 
+        # The window is shown right away while ffmpeg, ffprobe and mutagen are checked in the background.
+        self.dependency_queue = queue.Queue()
+        threading.Thread(target=lambda: self.dependency_queue.put(find_missing_dependencies()), daemon=True).start()
+        self.after(DEPENDENCY_POLL_MS, self.check_dependency_queue)
+
+    def check_dependency_queue(self):
+        try:
+            missing = self.dependency_queue.get_nowait()
+        except queue.Empty:
+            self.after(DEPENDENCY_POLL_MS, self.check_dependency_queue)
+            return
+        if not missing:
+            return
+        logging.error(f"Missing dependencies: {', '.join(missing)}")
+        self.missing_dependencies = missing
+        messagebox.showerror("Missing Dependencies",
+                             "The following dependencies are missing or not in PATH:\n\n" +
+                             "\n".join(f"- {dep}" for dep in missing) +
+                             "\n\nPlease install them and try again.")
+        self.destroy()
+
     def open_folder(self):
         folder_path = filedialog.askdirectory()
         if not folder_path:
             logging.info("No folder selected.")
             return
 
-        logging.info(f"Opening folder: {folder_path}")
-
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        self.file_paths.clear()
-
-        for filename in os.listdir(folder_path):
-            if filename.lower().endswith(('.mp3', '.wav', '.flac', '.m4a', '.ogg', '.opus')):
-                filepath = os.path.join(folder_path, filename)
-                self.load_audio_file(filepath)
-        logging.info("Finished loading files from folder.")
-
-    def get_audio_duration(self, filepath):
-        logging.debug(f"Getting duration for {filepath}")
-        try:
-            result = subprocess.run(
-                ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", filepath],
-                capture_output=True, text=True, check=True
-            )
-            duration = float(result.stdout.strip())
-            logging.debug(f"Duration for {filepath} is {duration}s.")
-            return duration
-        except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
-            logging.error(f"Could not get duration for {filepath}: {e}")
-            return 0
-
-    def load_audio_file(self, filepath):
-        logging.info(f"Loading audio file: {filepath}")
         try:
-            file_size = os.path.getsize(filepath) / (1024 * 1024)
-            duration = self.get_audio_duration(filepath)
+            min_size = max(0, int(float(self.min_size_var.get() or 0) * 1024))
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid number for the minimum file size.")
+            return
+        scan_options = {
+            "include": self.include_var.get().split(";"),
+            "exclude": self.exclude_var.get().split(";"),
+            "min_size": min_size,
+            "recursive": self.recursive_var.get(),
+            "follow_symlinks": self.follow_symlinks_var.get(),
+        }
 
+        logging.info(f"Opening folder: {folder_path} ({scan_options})")
+        self.cancel_load()
+
+        self.model.clear()
+        self.source_folder = folder_path
+        self.view_offset = 0
+        self.render_rows()
+
+        self.load_queue = queue.Queue()
+        self.load_cancel_event = threading.Event()
+        self.load_failures = []
+        self.loaded_count = 0
+
+        self.load_label.config(text="Scanning folder...")
+        self.load_progress_bar.start(10)
+        self.cancel_load_button.config(state="normal")
+        self.load_frame.pack(pady=(0, 10), before=self.button_frame)
+        self.process_button.config(state="disabled")
+
+        loading_thread = threading.Thread(target=self.folder_loading_thread, args=(folder_path, scan_options, self.load_queue, self.load_cancel_event), daemon=True)
+        loading_thread.start()
+        self.after(LOAD_POLL_MS, self.check_load_queue, self.load_queue)
+
+    def cancel_load(self):
+        if self.load_cancel_event and not self.load_cancel_event.is_set():
+            logging.info("Cancelling folder load.")
+            self.load_cancel_event.set()
+            self.load_label.config(text="Cancelling...")
+            self.cancel_load_button.config(state="disabled")
+
+    def folder_loading_thread(self, folder_path, scan_options, q, cancel_event):
+        """
+        Streams matching files from the folder scan into a worker pool that probes
+        them, reporting rows through the load queue. Only a bounded number of files
+        are in flight at once, so the full file list is never built up front.
+        """
+        max_workers = os.cpu_count() or 1
+        max_in_flight = max_workers * 4
+        in_flight = {}
+
+        def report(done_futures):
+            for future in done_futures:
+                filepath = in_flight.pop(future)
+                try:
+                    q.put(('row', future.result()))
+                except Exception as e:
+                    logging.error(f"Could not load file {os.path.basename(filepath)}: {e}")
+                    q.put(('failed', filepath, str(e)))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
             try:
-                tags = EasyID3(filepath)
-            except Exception as e:
-                logging.warning(f"Could not read ID3 tags for {filepath}: {e}")
-                tags = {}
-
-            title = tags.get('title', [''])[0]
-            artist = tags.get('artist', [''])[0]
-            album_artist = tags.get('albumartist', [''])[0]
-            album = tags.get('album', [''])[0]
-            track_number = tags.get('tracknumber', [''])[0]
-
-            item_id = self.tree.insert("", "end", values=(
-                os.path.basename(filepath),
-                f"{file_size:.2f}",
-                f"{duration:.2f}",
-                title,
-                artist,
-                album_artist,
-                album,
-                track_number,
-                "No",
-                "No"
-            ))
-            self.file_paths[item_id] = filepath
-            logging.info(f"Successfully loaded {os.path.basename(filepath)}.")
+                for filepath, file_size in scan_audio_files(folder_path, **scan_options):
+                    if cancel_event.is_set():
+                        break
+                    in_flight[executor.submit(self.load_audio_file, filepath, file_size, folder_path)] = filepath
+                    if len(in_flight) >= max_in_flight:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        report(done)
+                    else:
+                        report([future for future in in_flight if future.done()])
+                while in_flight and not cancel_event.is_set():
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    report(done)
+            finally:
+                for future in in_flight:
+                    future.cancel()
+        q.put(('done', cancel_event.is_set()))
+
+    def check_load_queue(self, q):
+        if q is not self.load_queue:
+            return  # A newer folder load has replaced this one.
+
+        rows = []
+        finished = None
+        try:
+            while True:
+                message = q.get_nowait()
+                if message[0] == 'row':
+                    rows.append(message[1])
+                elif message[0] == 'failed':
+                    _, filepath, error = message
+                    self.load_failures.append(f"{os.path.basename(filepath)}: {error}")
+                    self.loaded_count += 1
+                elif message[0] == 'done':
+                    finished = message
+                    break
+        except queue.Empty:
+            pass
 
-        except Exception as e:
-            logging.error(f"Could not load file {os.path.basename(filepath)}: {e}")
-            messagebox.showerror("Error", f"Could not load file {os.path.basename(filepath)}: {e}")
+        if rows:
+            self.model.extend(rows)
+            self.render_rows()
+        self.loaded_count += len(rows)
+
+        if finished is None:
+            if not self.load_cancel_event.is_set():
+                self.load_label.config(text=f"Loading files... {self.loaded_count} loaded")
+            self.after(LOAD_POLL_MS, self.check_load_queue, q)
+            return
+
+        _, cancelled = finished
+        self.load_progress_bar.stop()
+        self.load_frame.pack_forget()
+        if not self.processing:
+            self.process_button.config(state="normal")
+        self.load_queue = None
+        self.load_cancel_event = None
+        logging.info(f"{'Cancelled' if cancelled else 'Finished'} loading files from folder: {len(self.model.rows)} loaded.")
+        if self.load_failures:
+            message = f"{len(self.load_failures)} file(s) could not be loaded:\n\n" + "\n".join(self.load_failures[:10])
+            if len(self.load_failures) > 10:
+                message += f"\n\n...and {len(self.load_failures) - 10} more. See the log for details."
+            messagebox.showerror("Error", message)
+
+    def load_audio_file(self, filepath, file_size_bytes=None, folder_path=None):
+        """
+        Probes a file and returns its AudioRow, named by its path relative to
+        folder_path if given. Runs on loader threads, so it must not touch Tk.
+        """
+        logging.debug(f"Loading audio file: {filepath}")
+        if file_size_bytes is None:
+            file_size_bytes = os.path.getsize(filepath)
+        file_size = file_size_bytes / (1024 * 1024)
+        try:
+            probe = self.processor.probe_cache.probe(filepath)
+            duration, tags = probe.duration, probe.tags
+        except (subprocess.CalledProcessError, OSError, ValueError, KeyError) as e:
+            logging.error(f"Could not probe {filepath}: {e}")
+            duration, tags = 0, {}
+
+        title = tags.get('title', [''])[0]
+        artist = tags.get('artist', [''])[0]
+        album_artist = tags.get('albumartist', [''])[0]
+        album = tags.get('album', [''])[0]
+        track_number = tags.get('tracknumber', [''])[0]
+
+        return AudioRow(
+            filepath,
+            os.path.relpath(filepath, folder_path) if folder_path else os.path.basename(filepath),
+            file_size,
+            duration,
+            title,
+            artist,
+            album_artist,
+            album,
+            track_number,
+        )
+
+    def render_rows(self):
+        """Shows the window of the table model starting at self.view_offset in the Treeview."""
+        total = len(self.model)
+        self.view_offset = max(0, min(self.view_offset, total - self.visible_row_count))
+        focus = self.tree.focus()
+        selection = self.tree.selection()
+
+        self.tree.delete(*self.tree.get_children())
+        for view_index in range(self.view_offset, min(total, self.view_offset + self.visible_row_count)):
+            row_index = self.model.view[view_index]
+            # Item ids are row indices in the model, so they stay valid across scrolling.
+            self.tree.insert("", "end", iid=str(row_index), values=self.model.rows[row_index].display_values())
+
+        if focus and self.tree.exists(focus):
+            self.tree.focus(focus)
+        self.tree.selection_set([item for item in selection if self.tree.exists(item)])
+
+        if total:
+            self.tree_scroll_y.set(self.view_offset / total, min(1.0, (self.view_offset + self.visible_row_count) / total))
+        else:
+            self.tree_scroll_y.set(0, 1)
+
+    def on_scroll(self, *args):
+        total = len(self.model)
+        if args[0] == "moveto":
+            self.view_offset = int(float(args[1]) * total)
+        elif args[0] == "scroll":
+            step = self.visible_row_count if args[2] == "pages" else 1
+            self.view_offset += int(args[1]) * step
+        self.render_rows()
+
+    def on_mouse_wheel(self, event):
+        if event.num == 4:
+            delta = -3
+        elif event.num == 5:
+            delta = 3
+        else:
+            delta = -3 if event.delta > 0 else 3
+        self.view_offset += delta
+        self.render_rows()
+        return "break"
+
+    def on_tree_resize(self, event):
+        visible_row_count = max(1, (event.height - TREE_HEADING_HEIGHT) // TREE_ROW_HEIGHT)
+        if visible_row_count != self.visible_row_count:
+            self.visible_row_count = visible_row_count
+            self.render_rows()
+
+    def apply_filter(self):
+        self.model.set_filter(self.filter_var.get())
+        self.view_offset = 0
+        self.render_rows()
 
     def on_double_click(self, event):
         region = self.tree.identify("region", event.x, event.y)
@@ -141,15 +404,14 @@ class AudioMetadataEditor(tk.Tk):
         column_index = int(column_id.replace("#", "")) - 1
         column_name = self.tree["columns"][column_index]
 
-        editable_columns = ["title", "artist", "album_artist", "album", "track_number"]
-        checkbox_columns = ["trim_intro", "trim_outro"]
+        editable_columns = [column for column in TEXT_COLUMNS if column != "file_name"]
 
         if column_name in editable_columns:
-            self.edit_cell(event)
-        elif column_name in checkbox_columns:
-            self.toggle_checkbox(event)
+            self.edit_cell(event, column_name)
+        elif column_name in CHECKBOX_COLUMNS:
+            self.toggle_checkbox(event, column_name)
 
-    def edit_cell(self, event):
+    def edit_cell(self, event, column_name):
         item_id = self.tree.focus()
         if not item_id:
             return
@@ -158,54 +420,64 @@ class AudioMetadataEditor(tk.Tk):
 
         x, y, width, height = self.tree.bbox(item_id, column_id)
 
-        value = self.tree.set(item_id, column_id)
+        row_index = int(item_id)
+        value = getattr(self.model.rows[row_index], column_name)
         entry = ttk.Entry(self.tree_frame, width=width)
         entry.place(x=x, y=y, width=width, height=height)
         entry.insert(0, value)
         entry.focus()
 
         def on_focus_out(event):
-            self.tree.set(item_id, column_id, entry.get())
+            self.model.set_value(row_index, column_name, entry.get())
+            if self.tree.exists(item_id):
+                self.tree.set(item_id, column_id, entry.get())
             entry.destroy()
 
         entry.bind("<FocusOut>", on_focus_out)
         entry.bind("<Return>", on_focus_out)
 
-    def toggle_checkbox(self, event):
+    def toggle_checkbox(self, event, column_name):
         item_id = self.tree.focus()
         if not item_id:
             return
 
-        column_id = self.tree.identify_column(event.x)
-        current_value = self.tree.set(item_id, column_id)
-        new_value = "Yes" if current_value == "No" else "No"
-        self.tree.set(item_id, column_id, new_value)
+        row_index = int(item_id)
+        row = self.model.rows[row_index]
+        self.model.set_value(row_index, column_name, not getattr(row, column_name))
+        self.tree.set(item_id, column_name, row.display_value(column_name))
 
 
     def sort_column(self, col, reverse):
-        l = [(self.tree.set(k, col), k) for k in self.tree.get_children('')]
-        try:
-            l.sort(key=lambda t: float(t[0]), reverse=reverse)
-        except ValueError:
-            l.sort(key=lambda t: t[0], reverse=reverse)
-
-        for index, (val, k) in enumerate(l):
-            self.tree.move(k, '', index)
+        self.model.sort(col, reverse)
+        self.render_rows()
 
         self.tree.heading(col, command=lambda: self.sort_column(col, not reverse))
 
     def process_files(self):
-        output_folder = filedialog.askdirectory()
-        if not output_folder:
-            logging.info("Processing cancelled, no output folder selected.")
-            return
-
-        items = self.tree.get_children('')
+        items = self.model.visible_rows()
         if not items:
             messagebox.showinfo("No files", "There are no files to process.")
             return
+        if len(items) < len(self.model.rows):
+            logging.info(f"Filter is active, processing {len(items)} of {len(self.model.rows)} file(s).")
+
+        tags_in_place = self.tags_in_place_var.get()
+        if tags_in_place and all(is_tag_only(row.path, row.trim_intro, row.trim_outro) for row in items):
+            output_folder = None
+        else:
+            output_folder = filedialog.askdirectory()
+            if not output_folder:
+                logging.info("Processing cancelled, no output folder selected.")
+                return
+
+        try:
+            max_workers = max(1, int(self.max_workers_var.get()))
+        except (tk.TclError, ValueError):
+            max_workers = os.cpu_count() or 1
 
-        logging.info(f"Starting to process files. Output folder: {output_folder}")
+        logging.info(f"Starting to process files with {max_workers} parallel job(s). Output folder: {output_folder}")
+        self.processing = True
+        self.process_button.config(state="disabled")
 
         self.progress_window = tk.Toplevel(self)
         self.progress_window.title("Processing...")
@@ -227,293 +499,163 @@ class AudioMetadataEditor(tk.Tk):
         self.queue = queue.Queue()
         self.check_queue()
 
-        processing_thread = threading.Thread(target=self.processing_thread, args=(output_folder, self.queue, items))
+        options = BatchOptions(
+            output_folder=output_folder,
+            source_folder=self.source_folder,
+            max_workers=max_workers,
+            lossless_mp3=self.lossless_mp3_var.get(),
+            tags_in_place=tags_in_place,
+            skip_completed=self.skip_completed_var.get(),
+            stage_outputs=self.stage_outputs_var.get(),
+            cache_outputs=self.cache_outputs_var.get(),
+        )
+        processing_thread = threading.Thread(target=self.processing_thread, args=(self.queue, items, options))
         processing_thread.start()
 
     def check_queue(self):
+        """
+        Drains every pending progress message on each tick and applies only the
+        latest value per bar, so the window keeps up however fast workers report
+        while the widgets are redrawn at most once per PROGRESS_POLL_MS.
+        """
+        total_progress = None
+        sub_task_start = None
+        sub_task_value = None
+        sub_task_text = None
+        sub_task_visible = None
+        errors = []
+        report = None
+        complete = False
         try:
-            message = self.queue.get_nowait()
-            if message[0] == 'progress':
-                _, text, value = message
-                self.total_progress_label.config(text=text)
-                self.total_progress_bar['value'] = value
-            elif message[0] == 'sub_task_start':
-                _, label, max_value = message
-                self.sub_task_label.config(text=label)
-                self.sub_task_progress_bar.config(maximum=max_value, value=0)
-                self.sub_task_label.pack(padx=20, pady=(10, 0))
-                self.sub_task_progress_bar.pack(padx=20, pady=(5, 10))
-            elif message[0] == 'sub_task_progress':
-                _, value = message
-                self.sub_task_progress_bar['value'] = value
-            elif message[0] == 'sub_task_end':
-                self.sub_task_label.pack_forget()
-                self.sub_task_progress_bar.pack_forget()
-            elif message[0] == 'complete':
-                self.total_progress_label.config(text="Processing complete!")
-                self.sub_task_label.pack_forget()
-                self.sub_task_progress_bar.pack_forget()
-                self.progress_window.after(2000, self.progress_window.destroy)
-                return # Stop checking
-            elif message[0] == 'error':
-                 _, title, msg = message
-                 messagebox.showerror(title, msg)
-
+            while True:
+                message = self.queue.get_nowait()
+                if message[0] == 'progress':
+                    total_progress = message[1:]
+                elif message[0] == 'sub_task_start':
+                    sub_task_start = message[1:]
+                    sub_task_value = None
+                    sub_task_text = None
+                    sub_task_visible = True
+                elif message[0] == 'sub_task_progress':
+                    sub_task_value = message[1]
+                    if len(message) > 2:
+                        sub_task_text = message[2]
+                elif message[0] == 'sub_task_end':
+                    sub_task_visible = False
+                elif message[0] == 'error':
+                    errors.append(message[1:])
+                elif message[0] == 'report':
+                    report = message[1]
+                elif message[0] == 'complete':
+                    complete = True
+                    break
         except queue.Empty:
             pass
-        self.after(100, self.check_queue)
-
-
-    def processing_thread(self, output_folder, q, items):
-        logging.info("Processing thread started.")
-        total_files = len(items)
-        logging.info(f"Found {total_files} file(s) to process.")
-
-        for i, item_id in enumerate(items):
-            full_path = self.file_paths[item_id]
-            filename = os.path.basename(full_path)
-            logging.info(f"[{i+1}/{total_files}] Starting processing for: {filename}")
-
-            q.put(('progress', f"Processing {i+1}/{total_files}: {filename}...", i + 1))
-
-            values = self.tree.item(item_id, "values")
-
-            new_metadata = {
-                "title": values[3],
-                "artist": values[4],
-                "album_artist": values[5],
-                "album": values[6],
-                "track_number": values[7],
-            }
-
-            trim_intro = values[8] == "Yes"
-            trim_outro = values[9] == "Yes"
-
-            output_filename = f"{os.path.splitext(os.path.basename(full_path))[0]}.mp3"
-            output_path = os.path.join(output_folder, output_filename)
 
-            try:
-                self.process_single_file(full_path, output_path, new_metadata, trim_intro, trim_outro, q)
-                logging.info(f"Successfully processed {filename}.")
-            except Exception as e:
-                error_message = f"Failed to process {os.path.basename(full_path)}: {e}"
-                if isinstance(e, subprocess.CalledProcessError):
-                    error_message += f"\n\nffmpeg error:\n{e.stderr}"
-                logging.error(error_message)
-                q.put(('error', "Processing Error", error_message))
-
-        logging.info("Processing thread finished.")
-        q.put(('complete',))
-
-
-    def process_single_file(self, input_path, output_path, metadata, trim_intro, trim_outro, q):
-        filename = os.path.basename(input_path)
-        logging.info(f"Processing details for {filename}: Trim Intro={trim_intro}, Trim Outro={trim_outro}")
-
-        if not trim_intro and not trim_outro:
-            logging.info(f"No trimming required for {filename}. Converting and applying metadata.")
-            if os.path.splitext(input_path)[1].lower() == '.mp3':
-                logging.info(f"Copying {filename} directly as it is an MP3.")
-                shutil.copy(input_path, output_path)
+        if total_progress is not None:
+            text, value = total_progress
+            self.total_progress_label.config(text=text)
+            self.total_progress_bar['value'] = value
+        if sub_task_start is not None:
+            label, max_value = sub_task_start
+            self.sub_task_label.config(text=label)
+            self.sub_task_progress_bar.config(maximum=max_value, value=0)
+        if sub_task_value is not None:
+            self.sub_task_progress_bar['value'] = sub_task_value
+        if sub_task_text is not None:
+            self.sub_task_label.config(text=sub_task_text)
+        if sub_task_visible is True:
+            self.sub_task_label.pack(padx=20, pady=(10, 0))
+            self.sub_task_progress_bar.pack(padx=20, pady=(5, 10))
+        elif sub_task_visible is False:
+            self.sub_task_label.pack_forget()
+            self.sub_task_progress_bar.pack_forget()
+
+        for title, msg in errors:
+            messagebox.showerror(title, msg)
+
+        if complete:
+            self.processing = False
+            if self.load_queue is None:
+                self.process_button.config(state="normal")
+            self.total_progress_label.config(text="Processing complete!")
+            self.sub_task_label.pack_forget()
+            self.sub_task_progress_bar.pack_forget()
+            if report is not None:
+                # Keep the window open so the timings can be read.
+                ttk.Label(self.progress_window, text=report, font="TkFixedFont", justify=tk.LEFT).pack(padx=20, pady=(10, 0))
+                ttk.Button(self.progress_window, text="Close", command=self.progress_window.destroy).pack(pady=10)
             else:
-                logging.info(f"Converting {filename} to MP3.")
-                subprocess.run(
-                    ["ffmpeg", "-i", input_path, "-codec:a", "libmp3lame", "-q:a", "2", output_path],
-                    check=True, capture_output=True, text=True
-                )
-            self.apply_metadata_to_file(output_path, metadata, input_path)
-            return
+                self.progress_window.after(2000, self.progress_window.destroy)
+            return # Stop checking
+        self.after(PROGRESS_POLL_MS, self.check_queue)
 
-        temp_dir = tempfile.mkdtemp()
-        logging.debug(f"Created temporary directory for processing: {temp_dir}")
-        try:
-            duration = self.get_audio_duration(input_path)
-            if duration == 0:
-                raise ValueError("Could not get audio duration.")
-
-            chunk_size_s = 600  # 10 minutes
-
-            # Optimized logic for long files that require trimming
-            if duration > chunk_size_s * 2:
-                logging.info("Using optimized 3-part splitting logic for long file.")
-                temp_files_to_concat = []
-                final_processed_path = None
-
-                # Part 1: Intro
-                if trim_intro:
-                    q.put(('sub_task_start', 'Trimming intro...', 1))
-                    intro_chunk_path = os.path.join(temp_dir, "01_intro.mp3")
-                    cmd = ["ffmpeg", "-y", "-i", input_path, "-t", str(chunk_size_s), "-af", "silenceremove=start_periods=1:start_threshold=-40dB", intro_chunk_path]
-                    logging.debug(f"Running ffmpeg command: {' '.join(cmd)}")
-                    subprocess.run(cmd, check=True, capture_output=True, text=True)
-                    temp_files_to_concat.append(intro_chunk_path)
-                    q.put(('sub_task_progress', 1))
-
-                # Part 2: Middle
-                middle_start_ss = chunk_size_s if trim_intro else 0
-                middle_end_ss = duration - chunk_size_s if trim_outro else duration
-                middle_duration = middle_end_ss - middle_start_ss
-
-                if middle_duration > 0:
-                    q.put(('sub_task_start', 'Extracting middle section...', 1))
-                    middle_chunk_path = os.path.join(temp_dir, "02_middle.mp3")
-                    cmd = ["ffmpeg", "-y", "-ss", str(middle_start_ss), "-i", input_path, "-t", str(middle_duration), "-c", "copy", middle_chunk_path]
-                    logging.debug(f"Running ffmpeg command: {' '.join(cmd)}")
-                    subprocess.run(cmd, check=True, capture_output=True, text=True)
-                    temp_files_to_concat.append(middle_chunk_path)
-                    q.put(('sub_task_progress', 1))
-
-                # Part 3: Outro
-                if trim_outro:
-                    q.put(('sub_task_start', 'Trimming outro...', 1))
-                    outro_chunk_path = os.path.join(temp_dir, "03_outro.mp3")
-                    cmd = ["ffmpeg", "-y", "-ss", str(duration - chunk_size_s), "-i", input_path, "-af", "areverse,silenceremove=start_periods=1:start_threshold=-40dB,areverse", outro_chunk_path]
-                    logging.debug(f"Running ffmpeg command: {' '.join(cmd)}")
-                    subprocess.run(cmd, check=True, capture_output=True, text=True)
-                    temp_files_to_concat.append(outro_chunk_path)
-                    q.put(('sub_task_progress', 1))
-
-                q.put(('sub_task_end',))
-
-                # Part 4: Concatenate
-                if not temp_files_to_concat:
-                    raise ValueError("No temporary files were created for concatenation.")
-
-                if len(temp_files_to_concat) == 1:
-                    logging.info("Only one part was processed, no concatenation needed.")
-                    final_processed_path = temp_files_to_concat[0]
-                else:
-                    logging.info(f"Concatenating {len(temp_files_to_concat)} parts.")
-                    q.put(('sub_task_start', f'Combining {len(temp_files_to_concat)} parts...', 1))
-                    list_path = os.path.join(temp_dir, "concat_list.txt")
-                    with open(list_path, "w", encoding="utf-8") as f:
-                        for chunk_path in temp_files_to_concat:
-                            safe_path = chunk_path.replace("\\", "/")
-                            f.write(f"file '{safe_path}'\n")
-
-                    final_processed_path = os.path.join(temp_dir, "concatenated.mp3")
-                    concat_cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", final_processed_path]
-                    logging.debug(f"Running ffmpeg command: {' '.join(concat_cmd)}")
-                    subprocess.run(concat_cmd, check=True, capture_output=True, text=True)
-                    q.put(('sub_task_progress', 1))
-
-                shutil.copy(final_processed_path, output_path)
-
-            # Fallback to old logic for shorter files
-            else:
-                logging.info("File is shorter than 20 mins, using standard chunking logic.")
-                num_chunks = math.ceil(duration / chunk_size_s)
-                q.put(('sub_task_start', f"Splitting into {num_chunks} chunks...", num_chunks))
-
-                temp_chunk_files = []
-                for i in range(num_chunks):
-                    start_time = i * chunk_size_s
-                    t_param = ["-t", str(chunk_size_s)] if i < num_chunks - 1 else []
-                    chunk_path = os.path.join(temp_dir, f"chunk{i}.mp3")
-                    q.put(('sub_task_progress', i + 1))
-
-                    ffmpeg_cmd = ["ffmpeg", "-y", "-i", input_path, "-ss", str(start_time)]
-                    ffmpeg_cmd.extend(t_param)
-                    if i == 0 and trim_intro:
-                        ffmpeg_cmd.extend(["-af", "silenceremove=start_periods=1:start_threshold=-40dB"])
-                    elif i == num_chunks - 1 and trim_outro:
-                        ffmpeg_cmd.extend(["-af", "areverse,silenceremove=start_periods=1:start_threshold=-40dB,areverse"])
-                    ffmpeg_cmd.append(chunk_path)
-
-                    subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
-                    temp_chunk_files.append(chunk_path)
-
-                q.put(('sub_task_start', f"Combining {len(temp_chunk_files)} chunks...", 1))
-                list_path = os.path.join(temp_dir, "concat_list.txt")
-                with open(list_path, "w", encoding="utf-8") as f:
-                    for chunk_path in temp_chunk_files:
-                        escaped_chunk = chunk_path.replace("'", "\\'")
-                        f.write(f"file '{escaped_chunk}'\n")
-
-                concatenated_path = os.path.join(temp_dir, "concatenated.mp3")
-                concat_cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", concatenated_path]
-                subprocess.run(concat_cmd, check=True, capture_output=True, text=True)
-                q.put(('sub_task_progress', 1))
-
-                shutil.copy(concatenated_path, output_path)
-
-            self.apply_metadata_to_file(output_path, metadata, input_path)
 
-        finally:
-            q.put(('sub_task_end',))
-            logging.info(f"Cleaning up temporary directory: {temp_dir}")
-            shutil.rmtree(temp_dir)
-
-    def apply_metadata_to_file(self, file_path, metadata, original_path):
-        filename = os.path.basename(file_path)
-        logging.info(f"Applying metadata to {filename}.")
-        audio = mutagen.File(file_path, easy=True)
-        if audio.tags is None:
-            logging.info(f"No existing tags found for {filename}, creating new ones.")
-            audio.add_tags()
-
-        # Copy all tags from original file first to preserve them
+    def processing_thread(self, q, items, options):
+        logging.info("Processing thread started.")
         try:
-            logging.debug(f"Copying existing tags from {os.path.basename(original_path)}.")
-            original_audio = mutagen.File(original_path, easy=True)
-            if original_audio and original_audio.tags:
-                audio.tags.clear()
-                for key, value in original_audio.tags.items():
-                    audio.tags[key] = value
+            self.process_items(q, items, options)
         except Exception as e:
-            logging.warning(f"Could not copy tags from {original_path}: {e}")
-
-        # Apply changes from GUI
-        logging.debug(f"Applying new metadata to {filename}: {metadata}")
-        audio['title'] = metadata.get('title', '')
-        audio['artist'] = metadata.get('artist', '')
-        audio['albumartist'] = metadata.get('album_artist', '')
-        audio['album'] = metadata.get('album', '')
-        audio['tracknumber'] = metadata.get('track_number', '')
-        audio.save()
-        logging.info(f"Metadata saved for {filename}.")
-
-
-def check_dependencies():
-    """Checks for required dependencies and exits if they are not found."""
-    missing_deps = []
-    try:
-        import tkinter
-        from tkinter import messagebox
-        # If tkinter is present, we can use messagebox.
-        # We need a root window to show the message, but we don't want the window to actually appear.
-        show_error = lambda title, msg: messagebox.showerror(title, msg)
-        root = tkinter.Tk()
-        root.withdraw()
-    except ImportError:
-        missing_deps.append("tkinter")
-        # If tkinter is not present, we can only print to stderr.
-        show_error = lambda title, msg: print(f"ERROR: {title}\n{msg}", file=sys.stderr)
-
-    try:
-        import mutagen
-    except ImportError:
-        missing_deps.append("mutagen")
-
-    try:
-        subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True, text=True)
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        missing_deps.append("ffmpeg (and ffprobe)")
-
-    if missing_deps:
-        error_message = ("The following dependencies are missing or not in PATH:\n\n" +
-                         "\n".join(f"- {dep}" for dep in missing_deps) +
-                         "\n\nPlease install them and try again.")
-        show_error("Missing Dependencies", error_message)
-        sys.exit(1)
+            logging.exception("Processing stopped by an unexpected error.")
+            q.put(('error', "Processing Error", f"Processing stopped by an unexpected error: {e}"))
+        finally:
+            # The progress window waits for this, so it is sent however processing ended.
+            logging.info("Processing thread finished.")
+            q.put(('complete',))
+
+    def process_items(self, q, items, options):
+        # Imported here rather than at startup, since only processing needs them.
+        from job_journal import JobJournal
+        from output_cache import OutputCache
+        from spool import Spool
+        from instrumentation import default_report_path, write_report, format_report
+
+        if options.cache_outputs and not self.output_cache_opened:
+            self.output_cache_opened = True
+            try:
+                self.output_cache = OutputCache()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"Output cache unavailable, every file will be re-encoded: {e}")
+        jobs = [plan_job(row.path, row.metadata(), row.trim_intro, row.trim_outro, options.output_folder,
+                         options.tags_in_place, source_root=options.source_folder)
+                for row in items]
+        try:
+            journal = JobJournal()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Job journal unavailable, completed outputs will not be skipped: {e}")
+            journal = None
+        # Staging builds each output in RAM or the local temp folder and writes it to the
+        # output folder once, which matters when that folder is on a network share.
+        spool = Spool() if options.stage_outputs else None
+        results, report = self.processor.run_batch(jobs, q, options.max_workers, options.lossless_mp3, journal=journal,
+                                                   resume=options.skip_completed, spool=spool,
+                                                   output_cache=self.output_cache if options.cache_outputs else None)
+
+        errors = [result["error"] for result in results if result["status"] == "failed"]
+        if errors:
+            summary = f"{len(errors)} of {len(results)} file(s) failed to process:\n\n" + "\n\n".join(errors[:10])
+            if len(errors) > 10:
+                summary += f"\n\n...and {len(errors) - 10} more. See the log for details."
+            q.put(('error', "Processing Error", summary))
+
+        report_path = default_report_path()
+        try:
+            write_report(report, report_path)
+            logging.info(f"Wrote timing report to {report_path}.")
+        except OSError as e:
+            logging.warning(f"Could not write timing report to {report_path}: {e}")
+        q.put(('report', format_report(report)))
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-    check_dependencies()
-
     logging.info("Application starting.")
     app = AudioMetadataEditor()
+    if os.environ.get("BULKAUDIO_EXIT_AFTER_STARTUP"):
+        # Used by benchmark.py's startup stage: quit as soon as the window has been drawn.
+        app.after_idle(app.after, 0, app.destroy)
     app.mainloop()
     logging.info("Application closed.")
+    if app.missing_dependencies:
+        sys.exit(1)
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from probe_cache import default_cache_dir
+from engine import clone_file
+
+DEFAULT_OUTPUT_CACHE_MB = 5 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class OutputCache:
+    """
+    Keeps copies of trimmed/encoded audio, before tagging, in a cache folder keyed
+    by the SHA-256 of the input's content plus the trim and encode parameters, so
+    the same source processed the same way again is cloned from the cache instead
+    of going through ffmpeg. Entries are evicted least recently used first once
+    the folder grows past max_bytes. Input hashes are remembered per (path, size,
+    mtime) so unchanged sources are not re-read on every batch.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_OUTPUT_CACHE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir or os.path.join(default_cache_dir(), "outputs")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Reference counts of entries being copied out by fetch, which _evict leaves alone.
+        self._pinned = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS input_hashes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)"
+        )
+        self._db.commit()
+        self._evict()
+        logging.debug(f"Using output cache at {self.cache_dir} (limit {self.max_bytes / (1024 * 1024):.0f} MB).")
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def content_hash(self, filepath):
+        path = os.path.abspath(filepath)
+        st = os.stat(path)
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns, sha256 FROM input_hashes WHERE path = ?", (path,)).fetchone()
+        if row and (row[0], row[1]) == (st.st_size, st.st_mtime_ns):
+            return row[2]
+        sha256 = hash_file(path)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO input_hashes VALUES (?, ?, ?, ?)", (path, st.st_size, st.st_mtime_ns, sha256))
+            self._db.commit()
+        return sha256
+
+    def key_for(self, input_path, params):
+        """Cache key for an input file processed with params, a JSON-serializable dict."""
+        material = json.dumps({"input_sha256": self.content_hash(input_path), "params": params}, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def fetch(self, key, dst):
+        """Clones the cached audio for key to dst and returns True, or returns False on a miss."""
+        src = self._entry_path(key)
+        with self._lock:
+            row = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return False
+            if not os.path.exists(src):
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.commit()
+                return False
+            self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            # Pinned rather than copied under the lock, so other workers are not held up
+            # by a full copy while eviction still cannot remove the entry mid-copy.
+            self._pinned[key] = self._pinned.get(key, 0) + 1
+        try:
+            clone_file(src, dst)
+        finally:
+            with self._lock:
+                self._pinned[key] -= 1
+                if not self._pinned[key]:
+                    del self._pinned[key]
+        return True
+
+    def store(self, key, src):
+        """Adds src to the cache under key, then evicts old entries until the cache fits max_bytes."""
+        size = os.path.getsize(src)
+        if size > self.max_bytes:
+            return
+        dst = self._entry_path(key)
+        tmp = f"{dst}.{threading.get_ident()}.tmp"
+        try:
+            clone_file(src, tmp)
+            os.replace(tmp, dst)
+        except OSError as e:
+            logging.warning(f"Could not add {src} to the output cache: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, size, time.time()))
+            self._db.commit()
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            if key in self._pinned:
+                continue
+            try:
+                os.remove(self._entry_path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Could not evict {key} from the output cache: {e}")
+                continue
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            logging.debug(f"Evicted {key} from the output cache.")
+            if total <= self.max_bytes:
+                break
+        self._db.commit()
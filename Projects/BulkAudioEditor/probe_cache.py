@@ -0,0 +1,149 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+import subprocess
+from collections import namedtuple
+
+from tag_reader import TagReader
+
+ProbeResult = namedtuple("ProbeResult", ["duration", "codec", "bit_rate", "tags"])
+# Bumped whenever what is stored changes, which drops the cached entries. 2: tags
+# of every format mutagen reads instead of ID3 only.
+PROBE_CACHE_VERSION = 2
+
+
+def default_cache_dir():
+    """Returns the per-user cache directory used for the editor's on-disk caches."""
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "BulkAudioEditor")
+
+
+def run_ffprobe(filepath, timings=None):
+    """
+    Probes a file with a single ffprobe call and returns (duration, codec,
+    bit_rate). With timings (an instrumentation.StageTimings) the call is
+    recorded as the "probe" stage.
+    """
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "a:0",
+           "-show_entries", "format=duration,bit_rate:stream=codec_name", "-of", "json", filepath]
+    if timings is None:
+        stdout = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+    else:
+        with timings.process("probe") as child:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            # ffprobe -v error writes little to stderr, so reading stdout first cannot block on it.
+            stdout = proc.stdout.read()
+            stderr = proc.stderr.read()
+            proc.stdout.close()
+            proc.stderr.close()
+            if child.wait(proc) != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    info = json.loads(stdout)
+    fmt = info.get("format", {})
+    streams = info.get("streams") or [{}]
+    duration = float(fmt["duration"])
+    bit_rate = int(fmt["bit_rate"]) if fmt.get("bit_rate", "N/A") != "N/A" else 0
+    return duration, streams[0].get("codec_name", ""), bit_rate
+
+
+def probe_sample_rate(filepath):
+    """Returns the sample rate of a file's first audio stream in Hz, or 0 if ffprobe cannot tell."""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=sample_rate", "-of", "json", filepath],
+        capture_output=True, text=True, check=True
+    )
+    streams = json.loads(result.stdout).get("streams") or [{}]
+    try:
+        return int(streams[0].get("sample_rate", 0))
+    except ValueError:
+        return 0
+
+
+class ProbeCache:
+    """
+    Caches ffprobe and tag results per file, in memory and in an SQLite database,
+    keyed by (path, size, mtime). An entry is re-probed as soon as the file's size
+    or modification time changes.
+    """
+
+    def __init__(self, db_path=None, tag_reader=None):
+        self._memory = {}
+        self._lock = threading.Lock()
+        self.tag_reader = tag_reader or TagReader()
+        self._db = None
+        if db_path is None:
+            db_path = os.path.join(default_cache_dir(), "probe_cache.sqlite3")
+        try:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            # WAL with relaxed syncing keeps the per-file commits cheap while a folder loads.
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != PROBE_CACHE_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS probes")
+                self._db.execute(f"PRAGMA user_version = {PROBE_CACHE_VERSION}")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "duration REAL, codec TEXT, bit_rate INTEGER, tags TEXT)"
+            )
+            self._db.commit()
+            logging.debug(f"Using probe cache database at {db_path}.")
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Probe cache database unavailable, caching in memory only: {e}")
+            self._db = None
+
+    def get(self, filepath):
+        """Returns the cached ProbeResult for a file, or None if missing or stale."""
+        path = os.path.abspath(filepath)
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._memory.get(path)
+            if cached and cached[0] == key:
+                return cached[1]
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT size, mtime_ns, duration, codec, bit_rate, tags FROM probes WHERE path = ?", (path,)
+            ).fetchone()
+            if not row or (row[0], row[1]) != key:
+                return None
+            result = ProbeResult(row[2], row[3], row[4], json.loads(row[5]))
+            self._memory[path] = (key, result)
+            return result
+
+    def probe(self, filepath, timings=None):
+        """
+        Returns the ProbeResult for a file, running ffprobe and reading tags only
+        on a cache miss. The tags are read on the tag reader's pool while ffprobe
+        runs. Misses are timed in timings if given.
+        """
+        result = self.get(filepath)
+        if result is not None:
+            return result
+
+        path = os.path.abspath(filepath)
+        st = os.stat(path)
+        tags = self.tag_reader.submit(path)
+        duration, codec, bit_rate = run_ffprobe(path, timings)
+        result = ProbeResult(duration, codec, bit_rate, tags.result())
+        self.put(path, (st.st_size, st.st_mtime_ns), result)
+        return result
+
+    def put(self, filepath, key, result):
+        path = os.path.abspath(filepath)
+        with self._lock:
+            self._memory[path] = (key, result)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (path, key[0], key[1], result.duration, result.codec, result.bit_rate, json.dumps(result.tags))
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Could not store probe result for {path}: {e}")
@@ -0,0 +1,52 @@
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Rough single-core throughput in audio seconds per wall-clock second, used to
+# order jobs and to predict how long a batch will take.
+ENCODE_SPEED = 100.0
+STREAM_COPY_SPEED = 1500.0
+DECODE_SPEED = 400.0
+# Predicted cost of an untrimmed MP3 that only gets new tags.
+TAG_ONLY_COST_S = 0.01
+
+
+def predict_makespan(costs, workers):
+    """Wall-clock seconds until the last task finishes when costs are run longest-first on workers."""
+    loads = [0.0] * max(1, workers)
+    for cost in sorted(costs, reverse=True):
+        heapq.heapreplace(loads, loads[0] + cost)
+    return max(loads)
+
+
+class Scheduler:
+    """
+    Runs tasks on a thread pool, always starting the most expensive pending task
+    next (longest processing time first), which keeps a long file from starting
+    last and running alone at the end of a batch. At most max_workers tasks are
+    handed to the pool at a time, so tasks added while the batch runs, such as
+    the segments of a split file, are still ordered by cost. Each task's then
+    callback is called with its finished future on the thread calling run, and
+    may add further tasks.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._pending = []
+        self._order = itertools.count()
+
+    def add(self, cost, fn, *args, then=None):
+        heapq.heappush(self._pending, (-cost, next(self._order), fn, args, then))
+
+    def run(self):
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while self._pending or in_flight:
+                while self._pending and len(in_flight) < self.max_workers:
+                    _, _, fn, args, then = heapq.heappop(self._pending)
+                    in_flight[executor.submit(fn, *args)] = then
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    then = in_flight.pop(future)
+                    if then is not None:
+                        then(future)
@@ -0,0 +1,72 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+DEFAULT_SPOOL_RAM_MB = 1024
+# RAM-backed folders tried in order; on systems without one everything is staged in the temp folder.
+RAM_DIRS = ("/dev/shm",)
+
+
+def default_ram_dir():
+    for path in RAM_DIRS:
+        if os.path.isdir(path) and os.access(path, os.W_OK):
+            return path
+    return None
+
+
+class Spool:
+    """
+    Hands out private working folders where outputs are built, tagged and cached
+    before being published to their destination with a single write, which keeps
+    intermediate files and tag rewrites off slow or network-mounted output
+    folders. Folders go into a RAM-backed directory while the expected sizes of
+    all folders in use stay under ram_limit bytes, and into the local temp
+    folder otherwise.
+    """
+
+    def __init__(self, ram_limit=DEFAULT_SPOOL_RAM_MB * 1024 * 1024, ram_dir=None, disk_dir=None):
+        self.ram_limit = ram_limit
+        self.ram_dir = ram_dir if ram_dir is not None else default_ram_dir()
+        self.disk_dir = disk_dir or tempfile.gettempdir()
+        self._ram_used = 0
+        self._reserved = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, expected_bytes):
+        """Creates a working folder for up to expected_bytes of files and returns its path."""
+        with self._lock:
+            in_ram = (self.ram_dir is not None and self._ram_used + expected_bytes <= self.ram_limit
+                      and shutil.disk_usage(self.ram_dir).free > expected_bytes)
+            if in_ram:
+                self._ram_used += expected_bytes
+        work_dir = tempfile.mkdtemp(prefix="bulkaudio-", dir=self.ram_dir if in_ram else self.disk_dir)
+        with self._lock:
+            self._reserved[work_dir] = expected_bytes if in_ram else 0
+        logging.debug(f"Spooling up to {expected_bytes / (1024 * 1024):.0f} MB in {work_dir}.")
+        return work_dir
+
+    def release(self, work_dir):
+        """Deletes a working folder and everything left in it."""
+        shutil.rmtree(work_dir, ignore_errors=True)
+        with self._lock:
+            self._ram_used -= self._reserved.pop(work_dir, 0)
+
+    @contextmanager
+    def reserve(self, expected_bytes):
+        work_dir = self.acquire(expected_bytes)
+        try:
+            yield work_dir
+        finally:
+            self.release(work_dir)
+
+    def publish(self, work_path, dst):
+        """Moves a finished file to dst, by rename where possible and with one sequential copy otherwise."""
+        try:
+            os.replace(work_path, dst)
+        except OSError:
+            # Different filesystem: copy the data once, then drop the spooled file.
+            shutil.copyfile(work_path, dst)
+            os.remove(work_path)
@@ -0,0 +1,151 @@
+import re
+
+COLUMNS = {
+    "file_name": "File Name",
+    "file_size": "File Size (MB)",
+    "duration": "Duration (s)",
+    "title": "Title",
+    "artist": "Contributing Artist(s)",
+    "album_artist": "Album Artist",
+    "album": "Album",
+    "track_number": "Track #",
+    "trim_intro": "Trim Intro",
+    "trim_outro": "Trim Outro"
+}
+TEXT_COLUMNS = ("file_name", "title", "artist", "album_artist", "album", "track_number")
+CHECKBOX_COLUMNS = ("trim_intro", "trim_outro")
+
+_LEADING_NUMBER_RE = re.compile(r"\s*(\d+)")
+
+
+class AudioRow:
+    """One file in the editor table. file_size is in MB, duration in seconds."""
+    __slots__ = ("path", "file_name", "file_size", "duration", "title", "artist",
+                 "album_artist", "album", "track_number", "trim_intro", "trim_outro")
+
+    def __init__(self, path, file_name, file_size, duration, title="", artist="",
+                 album_artist="", album="", track_number="", trim_intro=False, trim_outro=False):
+        self.path = path
+        self.file_name = file_name
+        self.file_size = file_size
+        self.duration = duration
+        self.title = title
+        self.artist = artist
+        self.album_artist = album_artist
+        self.album = album
+        self.track_number = track_number
+        self.trim_intro = trim_intro
+        self.trim_outro = trim_outro
+
+    def display_value(self, column):
+        value = getattr(self, column)
+        if column in CHECKBOX_COLUMNS:
+            return "Yes" if value else "No"
+        if column in ("file_size", "duration"):
+            return f"{value:.2f}"
+        return value
+
+    def display_values(self):
+        return tuple(self.display_value(column) for column in COLUMNS)
+
+    def metadata(self):
+        return {
+            "title": self.title,
+            "artist": self.artist,
+            "album_artist": self.album_artist,
+            "album": self.album,
+            "track_number": self.track_number,
+        }
+
+
+def _sort_key(row, column):
+    value = getattr(row, column)
+    if column == "track_number":
+        # "3/12" and "03" both sort as track 3; rows without a number go last.
+        match = _LEADING_NUMBER_RE.match(value)
+        return (int(match.group(1)) if match else float("inf"), value.casefold())
+    if isinstance(value, str):
+        return value.casefold()
+    return value
+
+
+class TableModel:
+    """
+    Source of truth for the editor table. Rows live in a plain list and the view is
+    a list of row indices after filtering and sorting. Sort keys and filter text are
+    computed once per row and column and only refreshed for edited rows, so sorting
+    and filtering large tables never goes through the Treeview.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.view = []
+        self.sort_column = None
+        self.sort_reverse = False
+        self.filter_text = ""
+        self._sort_keys = {}
+        self._search_text = []
+
+    def __len__(self):
+        return len(self.view)
+
+    def clear(self):
+        self.rows.clear()
+        self.view.clear()
+        self.sort_column = None
+        self.sort_reverse = False
+        self._sort_keys.clear()
+        self._search_text.clear()
+
+    def extend(self, new_rows):
+        """Adds rows and shows the ones matching the current filter, in the current sort order if any."""
+        start = len(self.rows)
+        self.rows.extend(new_rows)
+        self._refresh_search_text()
+        self.view.extend(i for i in range(start, len(self.rows)) if self._matches_filter(i))
+        if self.sort_column is not None:
+            # The view is already sorted up to the new rows, which the sort merges in cheaply.
+            self.sort(self.sort_column, self.sort_reverse)
+
+    def row_at(self, view_index):
+        return self.rows[self.view[view_index]]
+
+    def visible_rows(self):
+        return [self.rows[i] for i in self.view]
+
+    def set_value(self, row_index, column, value):
+        row = self.rows[row_index]
+        setattr(row, column, value)
+        if column in self._sort_keys:
+            # Rows added since the last sort by this column have no key yet.
+            self._keys_for(column)[row_index] = _sort_key(row, column)
+        if column in TEXT_COLUMNS:
+            self._search_text[row_index] = self._row_search_text(row)
+
+    def sort(self, column, reverse=False):
+        keys = self._keys_for(column)
+        self.view.sort(key=keys.__getitem__, reverse=reverse)
+        self.sort_column = column
+        self.sort_reverse = reverse
+
+    def set_filter(self, text):
+        """Keeps only rows whose text columns contain the text, case-insensitively, in the current sort order."""
+        self.filter_text = text.casefold().strip()
+        self.view = [i for i in range(len(self.rows)) if self._matches_filter(i)]
+        if self.sort_column is not None:
+            self.sort(self.sort_column, self.sort_reverse)
+
+    def _keys_for(self, column):
+        keys = self._sort_keys.setdefault(column, [])
+        if len(keys) < len(self.rows):
+            keys.extend(_sort_key(row, column) for row in self.rows[len(keys):])
+        return keys
+
+    def _refresh_search_text(self):
+        self._search_text.extend(self._row_search_text(row) for row in self.rows[len(self._search_text):])
+
+    def _row_search_text(self, row):
+        return "\n".join(getattr(row, column) for column in TEXT_COLUMNS).casefold()
+
+    def _matches_filter(self, row_index):
+        return not self.filter_text or self.filter_text in self._search_text[row_index]
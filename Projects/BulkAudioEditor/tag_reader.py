@@ -0,0 +1,82 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# The editor's tag keys (as in EasyID3) and, lowercased, the names the same field
+# goes by in other tag formats: ID3 frames (WAV/AIFF), Vorbis comments (FLAC, Ogg,
+# Opus), MP4 atoms, APEv2 and ASF. The first alias present with a value wins.
+TAG_ALIASES = {
+    "title": ("title", "tit2", "\xa9nam"),
+    "artist": ("artist", "tpe1", "\xa9art", "author"),
+    "albumartist": ("albumartist", "album artist", "album_artist", "tpe2", "aart", "wm/albumartist"),
+    "album": ("album", "talb", "\xa9alb", "wm/albumtitle"),
+    "tracknumber": ("tracknumber", "track", "trck", "trkn", "wm/tracknumber"),
+}
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, tuple):
+        # MP4 track numbers are (number, total) pairs.
+        return "/".join(str(part) for part in value if part)
+    return str(value)
+
+
+def _text_values(value):
+    if hasattr(value, "text"):
+        # ID3 frames keep their strings in .text.
+        value = value.text
+    if isinstance(value, (str, bytes, tuple)) or not hasattr(value, "__iter__"):
+        value = [value]
+    return [_text(item) for item in value]
+
+
+def read_tags(filepath):
+    """
+    Reads the tags of any format mutagen knows, reading just the file's headers,
+    and returns the editor's fields as a {key: [values]} dict with the keys of
+    TAG_ALIASES. Fields the file does not have are left out; files without tags
+    or in an unknown format give {}.
+    """
+    import mutagen
+    try:
+        audio = mutagen.File(filepath, easy=True)
+    except Exception as e:
+        logging.warning(f"Could not read tags for {filepath}: {e}")
+        return {}
+    if audio is None or not audio.tags:
+        return {}
+
+    by_name = {}
+    for name, value in audio.tags.items():
+        by_name.setdefault(str(name).lower(), value)
+    tags = {}
+    for key, aliases in TAG_ALIASES.items():
+        for alias in aliases:
+            values = [text for text in _text_values(by_name[alias]) if text] if alias in by_name else []
+            if values:
+                tags[key] = values
+                break
+    return tags
+
+
+class TagReader:
+    """
+    A thread pool dedicated to reading tags, so a file's tags are parsed while its
+    ffprobe call runs instead of after it. mutagen holds the GIL while parsing,
+    but the reads themselves overlap with the probes' I/O and subprocesses.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, filepath):
+        """Starts reading a file's tags and returns a future for the read_tags result."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tags")
+        return self._executor.submit(read_tags, filepath)
@@ -0,0 +1,185 @@
+import time
+import random
+import threading
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+
+# (connect, read) timeouts in seconds. Overpass queries along a whole route can
+# take a while on the server; Google answers quickly or not at all.
+ENDPOINT_TIMEOUTS = {
+    "directions": (5, 20),
+    "geocode": (5, 10),
+    "overpass": (5, 60),
+}
+DEFAULT_TIMEOUT = (5, 30)
+# Requests in flight per endpoint. The public Overpass instance allows only two
+# concurrent queries per client and answers more with 429.
+ENDPOINT_MAX_CONCURRENT = {
+    "overpass": 2,
+}
+POOL_SIZE = 10
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 8.0
+
+
+class EndpointStats:
+    """Counters for one endpoint. Latency covers every attempt, including retries."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self.total_latency_s = 0.0
+        self.max_latency_s = 0.0
+
+    def summary(self):
+        average = self.total_latency_s / self.requests if self.requests else 0.0
+        return (f"{self.requests} requests, {self.cache_hits} cache hits, {self.errors} errors, "
+                f"{self.retries} retries, {self.coalesced} coalesced, "
+                f"avg {average * 1000:.0f} ms, max {self.max_latency_s * 1000:.0f} ms")
+
+
+class ApiClient:
+    """
+    The one HTTP client all API calls go through. A shared requests.Session keeps
+    connections alive between calls, so only the first request to a host pays for
+    the TLS handshake. Each endpoint has its own timeouts and concurrency limit.
+    Requests that fail with a connection error, a timeout, 429 or 5xx are retried
+    up to MAX_RETRIES times with full-jitter exponential backoff, honouring
+    Retry-After. A request identical to one already in flight waits for that one
+    and shares its response instead of being sent again. With a cache (see
+    response_cache.ResponseCache) successful responses are stored and answered
+    from it without a request while they are fresh.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, cache=None):
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(ENDPOINT_TIMEOUTS), pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._stats = {}
+        self._slots = {endpoint: threading.BoundedSemaphore(limit) for endpoint, limit in ENDPOINT_MAX_CONCURRENT.items()}
+
+    def get(self, endpoint, url, params=None):
+        return self.request(endpoint, "GET", url, params=params)
+
+    def post(self, endpoint, url, data=None):
+        return self.request(endpoint, "POST", url, data=data)
+
+    def request(self, endpoint, method, url, params=None, data=None):
+        """
+        Sends a request and returns the final requests.Response, which may still
+        have an error status for the caller to check. Raises RequestException if
+        the last attempt failed to get a response at all.
+        """
+        cache_key = self.cache.key(endpoint, method, url, params, data) if self.cache is not None else None
+        cached = self.cache.get(cache_key) if cache_key is not None else None
+        # With a cache, requests it treats as the same are coalesced too.
+        key = cache_key or (method, url, tuple(sorted((params or {}).items())), tuple(sorted((data or {}).items())))
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, EndpointStats())
+            if cached is not None:
+                stats.cache_hits += 1
+                return _cached_response(url, *cached)
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                stats.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            response = self._send(endpoint, stats, method, url, params, data)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            if cache_key is not None and _cacheable(response):
+                self.cache.put(endpoint, cache_key, response.status_code, response.headers.get("Content-Type", ""), response.content)
+            future.set_result(response)
+            return response
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _send(self, endpoint, stats, method, url, params, data):
+        timeout = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        slots = self._slots.get(endpoint)
+        for attempt in range(MAX_RETRIES + 1):
+            started = time.monotonic()
+            response = error = None
+            try:
+                if slots is not None:
+                    with slots:
+                        response = self.session.request(method, url, params=params, data=data, timeout=timeout)
+                else:
+                    response = self.session.request(method, url, params=params, data=data, timeout=timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            latency = time.monotonic() - started
+            with self._lock:
+                stats.requests += 1
+                stats.total_latency_s += latency
+                stats.max_latency_s = max(stats.max_latency_s, latency)
+                failed = error is not None or response.status_code >= 400
+                if failed:
+                    stats.errors += 1
+                retry = attempt < MAX_RETRIES and (error is not None or response.status_code in RETRY_STATUSES)
+                if retry:
+                    stats.retries += 1
+            if not retry:
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(self._backoff(attempt, response))
+
+    def _backoff(self, attempt, response):
+        delay = random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), BACKOFF_MAX_S))
+        return delay
+
+    def stats(self):
+        """A one-line summary per endpoint used so far."""
+        with self._lock:
+            return {endpoint: stats.summary() for endpoint, stats in sorted(self._stats.items())}
+
+
+def _cacheable(response):
+    """Only complete answers are cached, not errors, quota denials or Overpass runtime errors reported with status 200."""
+    if response.status_code != 200:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    if not isinstance(body, dict):
+        return False
+    # Google APIs report errors in 'status'; Overpass in 'remark'.
+    return body.get("status", "OK") in ("OK", "ZERO_RESULTS") and "remark" not in body
+
+
+def _cached_response(url, status, content_type, body):
+    response = requests.models.Response()
+    response.status_code = status
+    response.headers["Content-Type"] = content_type
+    response._content = body
+    response.url = url
+    response.encoding = "utf-8"
+    return response
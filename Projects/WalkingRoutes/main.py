@@ -10,6 +10,15 @@ import requests
 import pyperclip
 import os
 import math
+from concurrent.futures import ThreadPoolExecutor
+
+from api_client import ApiClient, GEOCODE_URL, OVERPASS_URL
+from response_cache import ResponseCache
+from routing import create_backend
+
+# Candidate routes are fetched and scored in parallel, with at most this many
+# requests in flight. Overpass has a lower limit of its own, see api_client.
+MAX_CONCURRENT_REQUESTS = 6
 
 class App(tk.Tk):
     def __init__(self):
@@ -17,7 +26,10 @@ class App(tk.Tk):
         self.title("Walking Route Planner")
         self.geometry("1024x768")
 
-        # --- Load API key securely ---
+        # Recalculating, or dropping a pin near an earlier one, is answered from the cache without using API quota.
+        self.api = ApiClient(pool_size=MAX_CONCURRENT_REQUESTS, cache=ResponseCache())
+
+        # --- Load API key and routing backend securely ---
         try:
             # Look for config.ini in the same directory as the script
             script_dir = os.path.dirname(__file__)
@@ -26,9 +38,11 @@ class App(tk.Tk):
             if not os.path.exists(config_path):
                  raise FileNotFoundError("config.ini not found in the script directory.")
             config.read(config_path)
-            self.api_key = config['google_maps']['api_key']
+            # The key is only required for Google routing; geocoding without it fails when used.
+            self.api_key = config.get('google_maps', 'api_key', fallback='')
+            self.router = create_backend(config, script_dir, self.api, self.api_key, self.log)
         except Exception as e:
-            messagebox.showerror("Configuration Error", f"Could not load API key from 'config.ini'.\n\nError: {e}")
+            messagebox.showerror("Configuration Error", f"Could not load the configuration from 'config.ini'.\n\nError: {e}")
             self.destroy()
             return
 
@@ -39,6 +53,10 @@ class App(tk.Tk):
         # Logging and threading
         self.log_queue = queue.Queue()
         self.worker_thread = None
+        # Directions legs are fetched on a pool of their own, since the candidate pool's tasks wait for them.
+        self.leg_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS, thread_name_prefix="legs")
+        # Read from the checkbox when a calculation starts, since Tk variables must not be read from worker threads.
+        self.avoid_highways = False
 
         # --- GUI Setup ---
         main_frame = ttk.Frame(self)
@@ -118,6 +136,8 @@ class App(tk.Tk):
 
         # Start polling the log queue to update UI from worker threads
         self.after(100, self._process_log_queue)
+        # Loading an offline walking graph can take a few seconds, so it happens before the first calculation needs it.
+        threading.Thread(target=self.router.load, daemon=True).start()
 
     def calculate_route(self):
         """Kick off route calculation in a background thread and show progress/log UI."""
@@ -133,41 +153,41 @@ class App(tk.Tk):
             return
 
         # Disable UI elements that shouldn't be used while calculating
+        self.avoid_highways = self.avoid_highways_var.get()
         self.progress.start(10)
         self.log(f"Starting route calculation for target {target_duration_minutes} minutes...")
         self.worker_thread = threading.Thread(target=self._calculate_route_thread, args=(target_duration_minutes,), daemon=True)
         self.worker_thread.start()
 
     def get_directions_for_pins(self, pins, silent=False):
+        """
+        Returns walking directions for the loop pins[0] -> pins[1] -> ... -> pins[0]
+        in the Directions API's response shape, or None. Each leg is requested on
+        its own, all at once on the leg pool, and answered from the response cache
+        when the same leg was fetched before, so a route that only differs from an
+        earlier one in a few pins costs just the requests for its new legs.
+        """
         if not pins: return None
-        origin = f"{pins[0]['lat']},{pins[0]['lng']}"
-        destination = origin
-        waypoints_str = "|".join([f"{p['lat']},{p['lng']}" for p in pins[1:]])
-
-        url = f"https://maps.googleapis.com/maps/api/directions/json?origin={origin}&destination={destination}&waypoints={waypoints_str}&mode=walking&key={self.api_key}"
-        if self.avoid_highways_var.get():
-            url += "&avoid=highways|tolls|ferries"
+        if self.avoid_highways:
             self.log("Avoiding highways, tolls, and ferries for this route.")
-
-        self.log(f"Calling Directions API: {url}")
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            directions = response.json()
-            if directions.get('status') == 'OK':
-                self.log(f"Directions API returned OK. Route contains {len(directions['routes'][0]['legs'])} legs.")
-                return directions
-            else:
-                self.log(f"Directions API returned status: {directions.get('status')} - {directions.get('error_message')}" )
+        stops = pins + [pins[0]]
+        results = list(self.leg_executor.map(self.get_leg, stops, stops[1:]))
+        for leg, error_title, error_message in results:
+            if leg is None:
                 if not silent:
                     # Show a message on the main thread
-                    self.after(0, lambda: messagebox.showerror("Directions API Error", f"Could not find a route: {directions.get('error_message', directions.get('status'))}"))
+                    self.after(0, lambda: messagebox.showerror(error_title, error_message))
                 return None
-        except requests.exceptions.RequestException as e:
-            self.log(f"Directions API connection error: {e}")
-            if not silent:
-                self.after(0, lambda: messagebox.showerror("Connection Error", f"Failed to connect to Directions API: {e}"))
-            return None
+        legs = [leg for leg, _, _ in results]
+        self.log(f"Directions assembled. Route contains {len(legs)} legs.")
+        return {'status': 'OK', 'routes': [{'legs': legs}]}
+
+    def get_leg(self, start, end):
+        """
+        Returns the walking leg from start to end from the routing backend as
+        (leg, None, None), or (None, error_title, error_message) if there is none.
+        """
+        return self.router.leg(start, end, self.avoid_highways)
 
     def get_route_duration(self, directions):
         if not directions: return 0
@@ -187,10 +207,9 @@ class App(tk.Tk):
     def search_location(self, event=None):
         location = self.address_entry.get()
         if not location: return
-        geocode_url = f"https://maps.googleapis.com/maps/api/geocode/json?address={location}&key={self.api_key}"
         self.log(f"Calling Geocoding API for '{location}'")
         try:
-            response = requests.get(geocode_url)
+            response = self.api.get("geocode", GEOCODE_URL, {'address': location, 'key': self.api_key})
             response.raise_for_status()
             results = response.json().get('results', [])
             if results:
@@ -205,11 +224,10 @@ class App(tk.Tk):
 
     def add_pin_from_map(self, coords):
         lat, lng = coords
-        rev_geocode_url = f"https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lng}&key={self.api_key}"
         address = f"Lat: {lat:.5f}, Lng: {lng:.5f}"
         self.log(f"Reverse geocoding pin at {lat:.5f},{lng:.5f}")
         try:
-            response = requests.get(rev_geocode_url)
+            response = self.api.get("geocode", GEOCODE_URL, {'latlng': f"{lat},{lng}", 'key': self.api_key})
             response.raise_for_status()
             results = response.json().get('results', [])
             if results:
@@ -324,14 +342,17 @@ class App(tk.Tk):
         """
         try:
             initial_pins = self.pins[:]
-            candidate_routes = []
 
-            if len(initial_pins) == 1:
-                self.log("Single pin detected. Generating loop route...")
-                candidate_routes = self._generate_loop_route(initial_pins[0], target_duration_minutes)
-            else:
-                self.log(f"{len(initial_pins)} pins detected. Generating detour route...")
-                candidate_routes = self._generate_detour_route(initial_pins, target_duration_minutes)
+            # Each candidate is fetched and scored as one task, so the whole calculation
+            # takes about as long as the slowest candidate rather than all of them in turn.
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+                if len(initial_pins) == 1:
+                    self.log("Single pin detected. Generating loop route...")
+                    futures = self._generate_loop_route(initial_pins[0], target_duration_minutes, executor)
+                else:
+                    self.log(f"{len(initial_pins)} pins detected. Generating detour route...")
+                    futures = self._generate_detour_route(initial_pins, target_duration_minutes, executor)
+                candidate_routes = [route for route in (future.result() for future in futures) if route]
 
             if not candidate_routes:
                 self.log("No candidate routes could be generated.")
@@ -339,17 +360,14 @@ class App(tk.Tk):
                 self.after(0, lambda: self.progress.stop())
                 return
 
-            self.log(f"Scoring {len(candidate_routes)} candidate routes...")
             best_route = None
             best_score = float('inf')
 
-            for i, route in enumerate(candidate_routes):
-                self.log(f"Scoring candidate route #{i+1}...")
-                score = self._calculate_route_score(route, target_duration_minutes)
-                if score < best_score:
-                    best_score = score
+            for route in candidate_routes:
+                if route['score'] < best_score:
+                    best_score = route['score']
                     best_route = route
-                    self.log(f"New best route found: Candidate #{i+1} with score {score:.1f}")
+                    self.log(f"New best route found: {route['label']} with score {best_score:.1f}")
 
             if not best_route:
                  self.log("All candidate routes failed scoring.")
@@ -358,6 +376,8 @@ class App(tk.Tk):
                  return
 
             self.log(f"Selected best route with final score: {best_score:.1f}")
+            for endpoint, summary in self.api.stats().items():
+                self.log(f"API {endpoint}: {summary}")
 
             # Schedule UI updates on main thread
             def _finalize():
@@ -372,15 +392,38 @@ class App(tk.Tk):
         except Exception as e:
             self.log(f"Unexpected error during route calculation: {e}")
             # Use after() to ensure messagebox is called from the main thread
-            self.after(0, lambda: messagebox.showerror("Error", f"An unexpected error occurred: {e}"))
+            self.after(0, lambda e=e: messagebox.showerror("Error", f"An unexpected error occurred: {e}"))
             self.after(0, lambda: self.progress.stop())
 
-    def _generate_loop_route(self, start_pin, target_duration_minutes):
+    def _evaluate_candidate(self, label, route_pins, target_duration_minutes, directions=None):
+        """
+        Fetches directions for route_pins, unless they are given, and scores the
+        route. Returns the candidate route dict including its score, or None if
+        no route was found. Runs on the candidate pool.
+        """
+        if directions is None:
+            self.log(f"{label}: Requesting route with {len(route_pins) - 1} waypoints.")
+            directions = self.get_directions_for_pins(route_pins, silent=True)
+            if not directions:
+                self.log(f"{label}: Could not generate a route.")
+                return None
+        duration = self.get_route_duration(directions)
+        self.log(f"{label}: Route generated, duration {duration:.1f} mins.")
+        route = {
+            'label': label,
+            'directions': directions,
+            'pins': route_pins,
+            'duration': duration,
+        }
+        route['score'] = self._calculate_route_score(route, target_duration_minutes)
+        return route
+
+    def _generate_loop_route(self, start_pin, target_duration_minutes, executor):
         """
         Generates candidate loop routes from a single starting point by creating
-        geometric anchor points.
+        geometric anchor points. Returns futures of the evaluated candidates, see
+        _evaluate_candidate.
         """
-        candidate_routes = []
         # Avg walking speed: ~3 mph or ~4.8 km/h. Let's use 4.5 km/h for calculation.
         # km = (minutes / 60) * 4.5
         # We are making a loop, so the farthest point is roughly at duration / 4
@@ -422,31 +465,18 @@ class App(tk.Tk):
 
         # --- Generate Candidate Routes ---
         self.log(f"Generating routes for {len(anchor_sets)} geometric shapes...")
-        for i, anchors in enumerate(anchor_sets):
-            # Create the full list of waypoints for the API call
-            # The route is Start -> A1 -> A2 -> ... -> Start
-            route_pins = [start_pin] + anchors
-            self.log(f"Shape {i+1}: Requesting route with {len(anchors)} anchors.")
-            directions = self.get_directions_for_pins(route_pins, silent=True)
-            if directions:
-                duration = self.get_route_duration(directions)
-                self.log(f"Shape {i+1}: Route generated, duration {duration:.1f} mins.")
-                candidate_routes.append({
-                    'directions': directions,
-                    'pins': route_pins, # Store the pins including anchors
-                    'duration': duration,
-                })
-            else:
-                self.log(f"Shape {i+1}: Could not generate a route for this shape.")
-        return candidate_routes
+        # The route is Start -> A1 -> A2 -> ... -> Start
+        return [executor.submit(self._evaluate_candidate, f"Shape {i+1}", [start_pin] + anchors, target_duration_minutes)
+                for i, anchors in enumerate(anchor_sets)]
 
 
-    def _generate_detour_route(self, initial_pins, target_duration_minutes):
+    def _generate_detour_route(self, initial_pins, target_duration_minutes, executor):
         """
         Generates detour routes if the initial user-pinned route is shorter than
-        the target duration.
+        the target duration. The direct route is fetched first since the detours
+        are placed along it; it is then scored while the detours are fetched.
+        Returns futures of the evaluated candidates, see _evaluate_candidate.
         """
-        candidate_routes = []
         self.log("Calculating direct route for comparison...")
         initial_directions = self.get_directions_for_pins(initial_pins, silent=True)
         if not initial_directions:
@@ -456,48 +486,13 @@ class App(tk.Tk):
         initial_duration = self.get_route_duration(initial_directions)
         self.log(f"Initial route duration: {initial_duration:.1f} minutes.")
         # Add the original route as the first candidate
-        candidate_routes.append({
-            'directions': initial_directions,
-            'pins': initial_pins,
-            'duration': initial_duration,
-        })
+        candidates = [executor.submit(self._evaluate_candidate, "Direct route", initial_pins, target_duration_minutes, initial_directions)]
 
         # If the direct route is already long enough, no need for detours
         if initial_duration >= target_duration_minutes:
             self.log("Initial route is already long enough. No detours needed.")
         else:
             self.log(f"Initial route is shorter than target, generating detours...")
-    def _check_for_traffic_lights(self, route_points):
-        """
-        Queries the OpenStreetMap Overpass API to find traffic signals along a route.
-        """
-        self.log("Checking route for traffic lights via Overpass API...")
-        overpass_url = "https://overpass-api.de/api/interpreter"
-        # Build a query that looks for traffic signals within a radius of each point in the route
-        # Using a polyline is more efficient than querying every single point
-        polyline = " ".join([f"{lat} {lng}" for lat, lng in route_points])
-        query = f"""
-        [out:json];
-        (
-          node(around:20, {polyline})["highway"="traffic_signals"];
-        );
-        out count;
-        """
-        try:
-            response = requests.post(overpass_url, data={'data': query})
-            response.raise_for_status()
-            data = response.json()
-            # The 'total' count is available in the 'counts' element
-            count = int(data.get('elements', [{}])[0].get('tags', {}).get('total', 0))
-            self.log(f"Overpass API found {count} traffic signals.")
-            return count
-        except requests.exceptions.RequestException as e:
-            self.log(f"Overpass API request failed: {e}. Skipping traffic light check.")
-            return 0 # Return 0 if the API fails, so we don't unfairly penalize a good route
-        except (ValueError, IndexError, KeyError) as e:
-            self.log(f"Could not parse Overpass API response: {e}. Skipping traffic light check.")
-            return 0
-
             # --- Identify Longest Leg for Detour ---
             legs = initial_directions['routes'][0]['legs']
             # Note: The "legs" correspond to the segments between the waypoints provided
@@ -548,19 +543,38 @@ class App(tk.Tk):
                 # Insert the anchor into the pin list *after* the start of the longest leg
                 test_pins = initial_pins[:]
                 test_pins.insert(longest_leg_index + 1, anchor)
-                self.log(f"Detour {i+1}: Requesting route with new anchor.")
-                directions = self.get_directions_for_pins(test_pins, silent=True)
-                if directions:
-                    duration = self.get_route_duration(directions)
-                    self.log(f"Detour {i+1}: Route generated, duration {duration:.1f} mins.")
-                    candidate_routes.append({
-                        'directions': directions,
-                        'pins': test_pins,
-                        'duration': duration,
-                    })
-                else:
-                    self.log(f"Detour {i+1}: Could not generate a route for this anchor.")
-        return candidate_routes
+                candidates.append(executor.submit(self._evaluate_candidate, f"Detour {i+1}", test_pins, target_duration_minutes))
+        return candidates
+
+    def _check_for_traffic_lights(self, route_points):
+        """
+        Queries the OpenStreetMap Overpass API to find traffic signals along a route.
+        """
+        self.log("Checking route for traffic lights via Overpass API...")
+        # Build a query that looks for traffic signals within a radius of each point in the route
+        # Using a polyline is more efficient than querying every single point
+        polyline = " ".join([f"{lat} {lng}" for lat, lng in route_points])
+        query = f"""
+        [out:json];
+        (
+          node(around:20, {polyline})["highway"="traffic_signals"];
+        );
+        out count;
+        """
+        try:
+            response = self.api.post("overpass", OVERPASS_URL, data={'data': query})
+            response.raise_for_status()
+            data = response.json()
+            # The 'total' count is available in the 'counts' element
+            count = int(data.get('elements', [{}])[0].get('tags', {}).get('total', 0))
+            self.log(f"Overpass API found {count} traffic signals.")
+            return count
+        except requests.exceptions.RequestException as e:
+            self.log(f"Overpass API request failed: {e}. Skipping traffic light check.")
+            return 0 # Return 0 if the API fails, so we don't unfairly penalize a good route
+        except (ValueError, IndexError, KeyError) as e:
+            self.log(f"Could not parse Overpass API response: {e}. Skipping traffic light check.")
+            return 0
 
     def _calculate_route_score(self, route, target_duration_minutes):
         """
@@ -572,7 +586,7 @@ class App(tk.Tk):
         # We use a percentage difference to make it fair for short vs long walks.
         duration_diff = abs(route['duration'] - target_duration_minutes)
         duration_score = (duration_diff / target_duration_minutes) * 100 # Percentage difference as a score
-        self.log(f"  - Duration score: {duration_score:.1f} (target: {target_duration_minutes}, actual: {route['duration']:.1f})")
+        self.log(f"{route['label']} - Duration score: {duration_score:.1f} (target: {target_duration_minutes}, actual: {route['duration']:.1f})")
 
         # --- 2. Overlap Score ---
         # Decode all polylines and count how many times each segment is used.
@@ -603,28 +617,31 @@ class App(tk.Tk):
                 overlap_penalty += (count - 1) * 25 # e.g., used twice = 25 penalty, thrice = 50
                 overlapped_segment_count += 1
 
-        self.log(f"  - Overlap score: {overlap_penalty} ({overlapped_segment_count} overlapped segments)")
+        self.log(f"{route['label']} - Overlap score: {overlap_penalty} ({overlapped_segment_count} overlapped segments)")
 
         # --- 3. Road Type Score (Traffic Light Penalty) ---
         traffic_light_penalty = 0
-        if self.avoid_highways_var.get():
+        if self.avoid_highways:
             # Only check for traffic lights if the user has toggled the option
             all_points = []
             for leg in route['directions']['routes'][0]['legs']:
                 for step in leg['steps']:
                     all_points.extend(self.decode_polyline(step['polyline']['points']))
 
-            traffic_light_count = self._check_for_traffic_lights(all_points)
+            # An offline walking graph knows its traffic signals; otherwise Overpass is asked.
+            traffic_light_count = self.router.count_traffic_lights(all_points)
+            if traffic_light_count is None:
+                traffic_light_count = self._check_for_traffic_lights(all_points)
             # Assign a very high penalty for each traffic light found
             traffic_light_penalty = traffic_light_count * 50
-            self.log(f"  - Traffic Light score: {traffic_light_penalty} ({traffic_light_count} lights found)")
+            self.log(f"{route['label']} - Traffic Light score: {traffic_light_penalty} ({traffic_light_count} lights found)")
         else:
-            self.log("  - Traffic Light score: 0 (check skipped by user)")
+            self.log(f"{route['label']} - Traffic Light score: 0 (check skipped by user)")
 
         # --- Final Score ---
         # Weights can be tuned. Let's make overlap and traffic lights very important.
         final_score = (duration_score * 1.5) + (overlap_penalty * 5.0) + traffic_light_penalty
-        self.log(f"  - TOTAL SCORE (lower is better): {final_score:.1f}")
+        self.log(f"{route['label']} - TOTAL SCORE (lower is better): {final_score:.1f}")
         return final_score
 
 if __name__ == "__main__":
@@ -0,0 +1,383 @@
+import sys
+import json
+import math
+import heapq
+import argparse
+from array import array
+import xml.etree.ElementTree as ET
+
+# Highway types a pedestrian may use. Motorways and trunk roads only count when
+# tagged foot=yes; anything tagged foot=no or closed to access is left out.
+WALKABLE_HIGHWAYS = {
+    "footway", "path", "pedestrian", "steps", "living_street", "residential",
+    "service", "unclassified", "track", "road", "cycleway", "bridleway", "corridor",
+    "tertiary", "tertiary_link", "secondary", "secondary_link", "primary", "primary_link",
+}
+# Busy roads, left out of routes when the user asks to avoid highways.
+MAJOR_HIGHWAYS = {"trunk", "trunk_link", "primary", "primary_link", "secondary", "secondary_link"}
+NO_ACCESS = {"no", "private"}
+FLAG_MAJOR = 1
+
+EARTH_RADIUS_M = 6371008.8
+# Grid cells for finding the nearest node, in degrees (about 220 m of latitude).
+GRID_CELL_DEG = 0.002
+# Pins farther than this from any walkable way are outside the map.
+MAX_SNAP_M = 500
+GRAPH_FORMAT = "walking-graph"
+GRAPH_VERSION = 1
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def encode_polyline(points):
+    """Encodes (lat, lng) points in Google's encoded polyline format, the inverse of App.decode_polyline."""
+    chunks = []
+    previous_lat = previous_lng = 0
+    for lat, lng in points:
+        lat, lng = int(round(lat * 1e5)), int(round(lng * 1e5))
+        for change in (lat - previous_lat, lng - previous_lng):
+            value = ~(change << 1) if change < 0 else change << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous_lat, previous_lng = lat, lng
+    return "".join(chunks)
+
+
+def _walkable(tags):
+    highway = tags.get("highway")
+    foot = tags.get("foot")
+    if highway is None or foot in NO_ACCESS or tags.get("area") == "yes":
+        return False
+    if foot in ("yes", "designated", "permissive"):
+        return True
+    return highway in WALKABLE_HIGHWAYS and tags.get("access") not in NO_ACCESS
+
+
+class _GraphBuilder:
+    """Collects nodes and walkable ways from an OSM extract and turns them into a WalkingGraph."""
+
+    def __init__(self):
+        self.locations = {}
+        self.ways = []
+        self.signals = []
+
+    def add_node(self, node_id, lat, lng, tags):
+        self.locations[node_id] = (lat, lng)
+        if tags.get("highway") == "traffic_signals":
+            self.signals.append((lat, lng))
+
+    def add_way(self, refs, tags):
+        if _walkable(tags):
+            flags = FLAG_MAJOR if tags["highway"] in MAJOR_HIGHWAYS else 0
+            self.ways.append((refs, tags.get("name", ""), flags))
+
+    def build(self):
+        index = {}
+        names = {"": 0}
+        edges = []
+        for refs, name, flags in self.ways:
+            name_index = names.setdefault(name, len(names))
+            previous = None
+            for ref in refs:
+                if ref not in self.locations:
+                    # Ways cut at the edge of the extract reference nodes it does not contain.
+                    previous = None
+                    continue
+                node = index.setdefault(ref, len(index))
+                if previous is not None and previous != node:
+                    edges.append((previous, node, name_index, flags))
+                previous = node
+        lats = array("d", [0.0]) * len(index)
+        lngs = array("d", [0.0]) * len(index)
+        for ref, node in index.items():
+            lats[node], lngs[node] = self.locations[ref]
+        graph = WalkingGraph(lats, lngs, *_csr(len(index), lats, lngs, edges), list(names), self.signals)
+        return graph.largest_component()
+
+
+def _csr(node_count, lats, lngs, edges):
+    """Both directions of every edge in compressed sparse row form: offsets, targets, lengths, names and flags per edge."""
+    degree = [0] * (node_count + 1)
+    for a, b, _, _ in edges:
+        degree[a + 1] += 1
+        degree[b + 1] += 1
+    offsets = array("l", degree)
+    for node in range(node_count):
+        offsets[node + 1] += offsets[node]
+    position = list(offsets[:-1])
+    size = offsets[-1]
+    targets, lengths = array("l", [0]) * size, array("f", [0.0]) * size
+    names, flags = array("l", [0]) * size, array("B", [0]) * size
+    for a, b, name, flag in edges:
+        length = haversine_m(lats[a], lngs[a], lats[b], lngs[b])
+        for source, target in ((a, b), (b, a)):
+            slot = position[source]
+            position[source] += 1
+            targets[slot], lengths[slot], names[slot], flags[slot] = target, length, name, flag
+    return offsets, targets, lengths, names, flags
+
+
+class WalkingGraph:
+    """
+    A pedestrian street graph in flat arrays: node coordinates, and each node's
+    outgoing edges as a slice offsets[node]:offsets[node + 1] of the per-edge
+    target, length (metres), street name index and flags arrays. Walkable ways
+    are split into edges between consecutive nodes, both ways. Traffic signals
+    are kept as coordinates for the route score.
+    """
+
+    def __init__(self, lats, lngs, offsets, targets, lengths, edge_names, edge_flags, names, signals):
+        self.lats, self.lngs = lats, lngs
+        self.offsets, self.targets, self.lengths = offsets, targets, lengths
+        self.edge_names, self.edge_flags = edge_names, edge_flags
+        self.names = names
+        self.signals = signals
+        self._grid = _grid(zip(lats, lngs))
+        self._signal_grid = _grid(signals)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def largest_component(self):
+        """The graph without the nodes that cannot reach its largest connected part, so pins never snap to an island."""
+        component = array("l", [-1]) * len(self)
+        sizes = []
+        for start in range(len(self)):
+            if component[start] != -1:
+                continue
+            label = len(sizes)
+            component[start] = label
+            stack, size = [start], 0
+            while stack:
+                node = stack.pop()
+                size += 1
+                for edge in range(self.offsets[node], self.offsets[node + 1]):
+                    target = self.targets[edge]
+                    if component[target] == -1:
+                        component[target] = label
+                        stack.append(target)
+            sizes.append(size)
+        if len(sizes) <= 1:
+            return self
+        keep = max(range(len(sizes)), key=sizes.__getitem__)
+        remap = array("l", [-1]) * len(self)
+        lats, lngs = array("d"), array("d")
+        for node in range(len(self)):
+            if component[node] == keep:
+                remap[node] = len(lats)
+                lats.append(self.lats[node])
+                lngs.append(self.lngs[node])
+        offsets, targets, lengths = array("l", [0]), array("l"), array("f")
+        edge_names, edge_flags = array("l"), array("B")
+        for node in range(len(self)):
+            if remap[node] == -1:
+                continue
+            for edge in range(self.offsets[node], self.offsets[node + 1]):
+                targets.append(remap[self.targets[edge]])
+                lengths.append(self.lengths[edge])
+                edge_names.append(self.edge_names[edge])
+                edge_flags.append(self.edge_flags[edge])
+            offsets.append(len(targets))
+        return WalkingGraph(lats, lngs, offsets, targets, lengths, edge_names, edge_flags, self.names, self.signals)
+
+    def nearest_node(self, lat, lng, max_distance_m=MAX_SNAP_M):
+        """Returns (node, distance_m) for the node closest to lat, lng, or (None, None) if none is within max_distance_m."""
+        return _nearest(self._grid, lambda node: (self.lats[node], self.lngs[node]), lat, lng, max_distance_m)
+
+    def shortest_path(self, source, target, avoid_flags=0):
+        """
+        A* search from source to target over the edges without any of avoid_flags,
+        with the straight-line distance to target as the heuristic. Returns the
+        path as lists of nodes and of the edges between them, or None if target
+        cannot be reached.
+        """
+        lats, lngs, offsets, targets, lengths, flags = self.lats, self.lngs, self.offsets, self.targets, self.lengths, self.edge_flags
+        target_lat, target_lng = lats[target], lngs[target]
+        # The squared-sine form of haversine_m inlined, since the heuristic runs once per edge relaxed.
+        cos_target = math.cos(math.radians(target_lat))
+        radians, sin, cos, asin, sqrt = math.radians, math.sin, math.cos, math.asin, math.sqrt
+
+        def heuristic(node):
+            lat = lats[node]
+            a = sin(radians(target_lat - lat) / 2) ** 2 + cos(radians(lat)) * cos_target * sin(radians(target_lng - lngs[node]) / 2) ** 2
+            return 2 * EARTH_RADIUS_M * asin(min(1.0, sqrt(a)))
+
+        distance = {source: 0.0}
+        # The node and edge each reached node was reached from.
+        came_from = {source: None}
+        queue = [(heuristic(source), source)]
+        done = set()
+        while queue:
+            _, node = heapq.heappop(queue)
+            if node == target:
+                break
+            if node in done:
+                continue
+            done.add(node)
+            base = distance[node]
+            for edge in range(offsets[node], offsets[node + 1]):
+                if flags[edge] & avoid_flags:
+                    continue
+                neighbour = targets[edge]
+                candidate = base + lengths[edge]
+                if candidate < distance.get(neighbour, math.inf):
+                    distance[neighbour] = candidate
+                    came_from[neighbour] = (node, edge)
+                    heapq.heappush(queue, (candidate + heuristic(neighbour), neighbour))
+        else:
+            return None
+
+        nodes, edges = [target], []
+        while came_from[nodes[-1]] is not None:
+            node, edge = came_from[nodes[-1]]
+            nodes.append(node)
+            edges.append(edge)
+        nodes.reverse()
+        edges.reverse()
+        return nodes, edges
+
+    def count_signals(self, points, radius_m=20):
+        """Counts the distinct traffic signals within radius_m of any of points."""
+        found = set()
+        for lat, lng in points:
+            found.update(_within(self._signal_grid, lambda i: self.signals[i], lat, lng, radius_m))
+        return len(found)
+
+    def to_json(self):
+        return {
+            "format": GRAPH_FORMAT,
+            "version": GRAPH_VERSION,
+            "lat": [round(value, 7) for value in self.lats],
+            "lng": [round(value, 7) for value in self.lngs],
+            "offsets": list(self.offsets),
+            "targets": list(self.targets),
+            "lengths": [round(value, 2) for value in self.lengths],
+            "edge_names": list(self.edge_names),
+            "edge_flags": list(self.edge_flags),
+            "names": self.names,
+            "signals": [[round(lat, 7), round(lng, 7)] for lat, lng in self.signals],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        if data.get("format") != GRAPH_FORMAT or data.get("version") != GRAPH_VERSION:
+            raise ValueError(f"Not a {GRAPH_FORMAT} file of version {GRAPH_VERSION}; convert the extract again with osm_graph.py.")
+        return cls(array("d", data["lat"]), array("d", data["lng"]), array("l", data["offsets"]), array("l", data["targets"]),
+                   array("f", data["lengths"]), array("l", data["edge_names"]), array("B", data["edge_flags"]),
+                   data["names"], [tuple(point) for point in data["signals"]])
+
+
+def _cell(lat, lng):
+    return int(math.floor(lat / GRID_CELL_DEG)), int(math.floor(lng / GRID_CELL_DEG))
+
+
+def _grid(points):
+    grid = {}
+    for i, (lat, lng) in enumerate(points):
+        grid.setdefault(_cell(lat, lng), []).append(i)
+    return grid
+
+
+def _rings(lat, lng, max_distance_m):
+    """Cells around lat, lng by growing ring, up to the ring that covers max_distance_m; yields (ring, cell size in metres, cells)."""
+    row, column = _cell(lat, lng)
+    cell_m = GRID_CELL_DEG * 111_000 * max(0.1, math.cos(math.radians(lat)))
+    for ring in range(int(max_distance_m / cell_m) + 2):
+        cells = [(row + dr, column + dc) for dr in range(-ring, ring + 1) for dc in range(-ring, ring + 1)
+                 if max(abs(dr), abs(dc)) == ring]
+        yield ring, cell_m, cells
+
+
+def _nearest(grid, location, lat, lng, max_distance_m):
+    best, best_distance = None, max_distance_m
+    for ring, cell_m, cells in _rings(lat, lng, max_distance_m):
+        # Points in this ring are at least (ring - 1) cells away.
+        if best is not None and (ring - 1) * cell_m > best_distance:
+            break
+        for cell in cells:
+            for i in grid.get(cell, ()):
+                distance = haversine_m(lat, lng, *location(i))
+                if distance <= best_distance:
+                    best, best_distance = i, distance
+    return (best, best_distance) if best is not None else (None, None)
+
+
+def _within(grid, location, lat, lng, radius_m):
+    for _, _, cells in _rings(lat, lng, radius_m):
+        for cell in cells:
+            for i in grid.get(cell, ()):
+                if haversine_m(lat, lng, *location(i)) <= radius_m:
+                    yield i
+
+
+def _read_xml(path, builder):
+    refs, tags = [], {}
+    for _, element in ET.iterparse(path, events=("end",)):
+        if element.tag == "tag":
+            tags[element.get("k")] = element.get("v")
+        elif element.tag == "nd":
+            refs.append(int(element.get("ref")))
+        elif element.tag in ("node", "way", "relation"):
+            if element.tag == "node":
+                builder.add_node(int(element.get("id")), float(element.get("lat")), float(element.get("lon")), tags)
+            elif element.tag == "way":
+                builder.add_way(refs, tags)
+            refs, tags = [], {}
+            element.clear()
+
+
+def _read_pbf(path, builder):
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError(f"Reading {path} needs the osmium package (pip install osmium). "
+                           "Alternatively use an .osm XML extract or a graph converted with osm_graph.py.") from None
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, node):
+            builder.add_node(node.id, node.location.lat, node.location.lon, dict(node.tags))
+
+        def way(self, way):
+            builder.add_way([ref.ref for ref in way.nodes], dict(way.tags))
+
+    Handler().apply_file(path)
+
+
+def load_graph(path):
+    """
+    Loads a WalkingGraph from an OpenStreetMap extract (.osm XML, or .pbf with
+    the optional osmium package) or from a .json graph written by this module.
+    """
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            return WalkingGraph.from_json(json.load(f))
+    builder = _GraphBuilder()
+    if path.endswith(".pbf"):
+        _read_pbf(path, builder)
+    else:
+        _read_xml(path, builder)
+    return builder.build()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Converts an OpenStreetMap extract into a walking graph that loads quickly.")
+    parser.add_argument("extract", help="an .osm or .osm.pbf extract")
+    parser.add_argument("output", help="the .json graph to write")
+    args = parser.parse_args(argv)
+    try:
+        graph = load_graph(args.extract)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(graph.to_json(), f, separators=(",", ":"))
+    except (OSError, ValueError, RuntimeError, ET.ParseError) as e:
+        parser.exit(1, f"{e}\n")
+    print(f"Wrote {args.output}: {len(graph)} nodes, {len(graph.targets) // 2} way segments, {len(graph.signals)} traffic signals.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# Coordinates in cache keys are rounded to this many decimals (4 is about 11 m),
+# so a pin dropped a few metres from an earlier one reuses its responses.
+COORDINATE_PRECISION = 4
+# How long responses stay valid, in seconds. Addresses rarely change, walking
+# directions and OpenStreetMap data more often.
+ENDPOINT_TTLS_S = {
+    "directions": 24 * 3600,
+    "geocode": 30 * 24 * 3600,
+    "overpass": 7 * 24 * 3600,
+}
+DEFAULT_TTL_S = 24 * 3600
+MEMORY_ENTRIES = 256
+DEFAULT_DISK_MB = 50
+# Request parameters that are credentials rather than part of the question.
+SECRET_PARAMS = ("key",)
+
+_DECIMAL_RE = re.compile(r"-?\d+\.\d+")
+
+
+def default_cache_dir():
+    """Returns the per-user cache directory for the planner's on-disk caches."""
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "WalkingRoutes")
+
+
+def quantize(text, precision=COORDINATE_PRECISION):
+    """Rounds every decimal number in text with more than precision decimals, e.g. the coordinates in '51.50123,-0.12345|...'."""
+    def _round(match):
+        value = match.group(0)
+        if len(value.split(".")[1]) <= precision:
+            return value
+        return f"{round(float(value), precision):.{precision}f}"
+    return _DECIMAL_RE.sub(_round, text)
+
+
+class ResponseCache:
+    """
+    Caches API responses in an in-memory LRU in front of an SQLite database,
+    keyed by the endpoint and its normalized request parameters (see key). Each
+    entry expires after its endpoint's TTL. The database is kept under
+    max_disk_bytes by dropping expired entries first and then the least recently
+    used ones. If the database cannot be opened, responses are cached in memory
+    only.
+    """
+
+    def __init__(self, db_path=None, precision=COORDINATE_PRECISION, ttls=None,
+                 memory_entries=MEMORY_ENTRIES, max_disk_bytes=DEFAULT_DISK_MB * 1024 * 1024):
+        self.precision = precision
+        self.ttls = dict(ENDPOINT_TTLS_S, **(ttls or {}))
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_bytes = 0
+        if db_path is None:
+            db_path = os.path.join(default_cache_dir(), "responses.sqlite3")
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, endpoint TEXT, expires REAL, last_used REAL, "
+                "status INTEGER, content_type TEXT, body BLOB)"
+            )
+            self._db.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+            self._db.commit()
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Response cache database unavailable, caching in memory only: {e}")
+            self._db = None
+
+    def key(self, endpoint, method, url, params=None, data=None):
+        """
+        The cache key for a request: its endpoint, method, URL and parameters with
+        credentials left out, sorted, and with coordinates quantized to precision.
+        """
+        def normalize(values):
+            return sorted((name, quantize(str(value), self.precision))
+                          for name, value in (values or {}).items() if name not in SECRET_PARAMS)
+        material = json.dumps([endpoint, method, url, normalize(params), normalize(data)])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns (status, content_type, body) for a fresh entry, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] >= now:
+                    self._memory.move_to_end(key)
+                    return entry[1:]
+                del self._memory[key]
+            if self._db is None:
+                return None
+            try:
+                row = self._db.execute(
+                    "SELECT expires, status, content_type, body FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or row[0] < now:
+                    return None
+                self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Could not read from the response cache: {e}")
+                return None
+            self._remember(key, tuple(row))
+            return row[1], row[2], row[3]
+
+    def put(self, endpoint, key, status, content_type, body):
+        now = time.time()
+        expires = now + self.ttls.get(endpoint, DEFAULT_TTL_S)
+        with self._lock:
+            self._remember(key, (expires, status, content_type, body))
+            if self._db is None or len(body) > self.max_disk_bytes:
+                return
+            try:
+                old = self._db.execute("SELECT LENGTH(body) FROM responses WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, endpoint, expires, now, status, content_type, body)
+                )
+                self._disk_bytes += len(body) - (old[0] if old else 0)
+                self._evict(now)
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Could not write to the response cache: {e}")
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        self._db.execute("DELETE FROM responses WHERE expires < ?", (now,))
+        self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+        for key, size in self._db.execute("SELECT key, LENGTH(body) FROM responses ORDER BY last_used").fetchall():
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._disk_bytes -= size
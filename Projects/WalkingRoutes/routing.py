@@ -0,0 +1,185 @@
+import os
+import time
+import threading
+import xml.etree.ElementTree as ET
+
+import requests
+
+from api_client import DIRECTIONS_URL
+from osm_graph import FLAG_MAJOR, encode_polyline, load_graph
+
+# Google's walking pace, so both backends give comparable durations.
+WALKING_SPEED_MPS = 1.35
+
+
+class RoutingBackend:
+    """
+    Answers walking legs for App.get_directions_for_pins. leg returns the leg in
+    the Directions API's response shape as (leg, None, None), or (None,
+    error_title, error_message) if there is no route. Called from the leg pool,
+    so it must be thread-safe.
+    """
+
+    name = None
+
+    def load(self):
+        """Prepares the backend; called once in the background at startup."""
+
+    def leg(self, start, end, avoid_highways=False):
+        raise NotImplementedError
+
+    def count_traffic_lights(self, route_points):
+        """The number of traffic signals along route_points, or None if this backend does not know."""
+        return None
+
+
+class GoogleDirectionsBackend(RoutingBackend):
+    """Legs from the Google Directions API, through the app's cached ApiClient."""
+
+    name = "google"
+
+    def __init__(self, api, api_key, log):
+        self.api = api
+        self.api_key = api_key
+        self.log = log
+
+    def leg(self, start, end, avoid_highways=False):
+        params = {'origin': f"{start['lat']},{start['lng']}", 'destination': f"{end['lat']},{end['lng']}", 'mode': 'walking'}
+        if avoid_highways:
+            params['avoid'] = "highways|tolls|ferries"
+
+        # Logged before the key is added so it does not end up in the log.
+        self.log(f"Calling Directions API: {params}")
+        try:
+            response = self.api.get("directions", DIRECTIONS_URL, dict(params, key=self.api_key))
+            response.raise_for_status()
+            directions = response.json()
+            if directions.get('status') == 'OK':
+                return directions['routes'][0]['legs'][0], None, None
+            self.log(f"Directions API returned status: {directions.get('status')} - {directions.get('error_message')}")
+            return None, "Directions API Error", f"Could not find a route: {directions.get('error_message', directions.get('status'))}"
+        except requests.exceptions.RequestException as e:
+            self.log(f"Directions API connection error: {e}")
+            return None, "Connection Error", f"Failed to connect to Directions API: {e}"
+
+
+class OsmRoutingBackend(RoutingBackend):
+    """
+    Legs routed offline with A* on a walking graph built from an OpenStreetMap
+    extract (see osm_graph), without network access or API quota. Pins are
+    snapped to the nearest walkable node, and each leg is split into one step
+    per street. With avoid_highways, primary and secondary roads are left out.
+    The graph is loaded once, on first use or by load at startup.
+    """
+
+    name = "osm"
+
+    def __init__(self, path, log):
+        self.path = path
+        self.log = log
+        self.graph = None
+        self._load_error = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.graph is None and self._load_error is None:
+                started = time.monotonic()
+                try:
+                    self.graph = load_graph(self.path)
+                except (OSError, ValueError, KeyError, RuntimeError, ET.ParseError) as e:
+                    self._load_error = f"Could not load the walking graph from {self.path}: {e}"
+                    self.log(self._load_error)
+                else:
+                    self.log(f"Loaded walking graph from {os.path.basename(self.path)}: {len(self.graph)} nodes "
+                             f"in {time.monotonic() - started:.1f} s.")
+        return self.graph
+
+    def leg(self, start, end, avoid_highways=False):
+        graph = self.load()
+        if graph is None:
+            return None, "Routing Error", self._load_error
+        source, _ = graph.nearest_node(start['lat'], start['lng'])
+        target, _ = graph.nearest_node(end['lat'], end['lng'])
+        if source is None or target is None:
+            return None, "Routing Error", "A pin is too far from any walkable way in the map."
+
+        started = time.monotonic()
+        path = graph.shortest_path(source, target, FLAG_MAJOR if avoid_highways else 0)
+        if path is None:
+            self.log(f"No walking route from node {source} to node {target}.")
+            return None, "Routing Error", "Could not find a walking route between the pins."
+        nodes, edges = path
+        self.log(f"Routed leg offline: {len(nodes)} nodes in {(time.monotonic() - started) * 1000:.0f} ms.")
+        return self._leg(graph, nodes, edges), None, None
+
+    def count_traffic_lights(self, route_points):
+        graph = self.load()
+        return graph.count_signals(route_points) if graph is not None else None
+
+    def _leg(self, graph, nodes, edges):
+        # A new step starts wherever the street name changes.
+        steps = []
+        first = 0
+        for i in range(1, len(edges) + 1):
+            if i == len(edges) or graph.edge_names[edges[i]] != graph.edge_names[edges[first]]:
+                name = graph.names[graph.edge_names[edges[first]]]
+                steps.append(_step(graph, nodes[first:i + 1], sum(graph.lengths[edge] for edge in edges[first:i]),
+                                   f"Walk along {name}" if name else "Walk"))
+                first = i
+        if not steps:
+            steps.append(_step(graph, nodes, 0.0, "Arrive"))
+        distance = sum(step['distance']['value'] for step in steps)
+        return {
+            'distance': _distance(distance),
+            'duration': _duration(distance),
+            'start_location': steps[0]['start_location'],
+            'end_location': steps[-1]['end_location'],
+            'steps': steps,
+        }
+
+
+def _location(graph, node):
+    return {'lat': graph.lats[node], 'lng': graph.lngs[node]}
+
+
+def _step(graph, nodes, distance, instructions):
+    return {
+        'distance': _distance(distance),
+        'duration': _duration(distance),
+        'start_location': _location(graph, nodes[0]),
+        'end_location': _location(graph, nodes[-1]),
+        'polyline': {'points': encode_polyline((graph.lats[node], graph.lngs[node]) for node in nodes)},
+        'html_instructions': instructions,
+        'travel_mode': 'WALKING',
+    }
+
+
+def _distance(metres):
+    metres = round(metres)
+    return {'value': metres, 'text': f"{metres / 1000:.1f} km" if metres >= 1000 else f"{metres} m"}
+
+
+def _duration(metres):
+    seconds = round(metres / WALKING_SPEED_MPS)
+    minutes = max(1, round(seconds / 60))
+    return {'value': seconds, 'text': f"{minutes} min" if minutes == 1 else f"{minutes} mins"}
+
+
+def create_backend(config, config_dir, api, api_key, log):
+    """
+    The backend chosen in the [routing] section of config.ini: backend = google
+    (the default) or osm, with osm_file naming the extract or converted graph,
+    relative to config_dir.
+    """
+    name = config.get('routing', 'backend', fallback=GoogleDirectionsBackend.name).strip().lower()
+    if name == GoogleDirectionsBackend.name:
+        if not api_key:
+            raise KeyError("api_key in [google_maps] is needed for the google routing backend")
+        return GoogleDirectionsBackend(api, api_key, log)
+    if name == OsmRoutingBackend.name:
+        path = config.get('routing', 'osm_file', fallback='')
+        if not path:
+            raise KeyError("osm_file in [routing] is needed for the osm routing backend")
+        return OsmRoutingBackend(os.path.join(config_dir, os.path.expanduser(path)), log)
+    raise ValueError(f"Unknown routing backend '{name}', expected 'google' or 'osm'")